@@ -1,7 +1,13 @@
+import asyncio
 import contextlib
+import functools
 import importlib.metadata
 import logging
 import os
+import re
+import shutil
+import tempfile
+import typing
 import urllib.parse
 import uuid
 from dataclasses import asdict
@@ -11,40 +17,123 @@ import aiohttp
 import asgiref.sync
 import click
 import jinja2.exceptions
+import krcg.collections
 import krcg.loader
 import markupsafe
-from fastapi import Depends, FastAPI, HTTPException, Request
-from fastapi.responses import JSONResponse, RedirectResponse
+import orjson
+from fastapi import Depends, FastAPI, HTTPException, Request, Response
+from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
+from starlette.datastructures import State
 from starlette.middleware.sessions import SessionMiddleware
 
-from . import api, db, discord, proposal, repository, utils
+from . import (
+    api,
+    cache,
+    changes,
+    cluster,
+    db,
+    discord,
+    events,
+    export,
+    health,
+    models,
+    proposal,
+    repository,
+    server,
+    utils,
+)
 
 logger = logging.getLogger()
 version = importlib.metadata.version("vtes-rulings")
 TESTING = bool(os.getenv("TESTING"))
 #: Bound on the active-proposals alert — both the query and the rendered links are capped (#30).
 ACTIVE_PROPOSALS_CAP = 15
+#: Card and group pages anonymous visitors get from the page cache, and the bound on its size
+#: (and on the card and group bodies cache, see render_current).
+CACHED_PAGES = ("index.html", "groups.html")
+PAGE_CACHE_BYTES = 64 * 1024 * 1024
+#: Seconds before retrying a failed startup phase
+LOAD_RETRY_DELAY = 10.0
+#: Served while the first index is loading: what does not need it
+LOADING_EXEMPT = ("/static/", "/healthz", "/readyz")
 PACKAGE_DIR = os.path.dirname(__file__)
 
 
-# Single-worker in-memory index model: `app.state.rulings_index` is the live view of the
-# rulings, mutated in place on approval (see api.approve_proposal). Running more than one worker
-# would give each its own divergent index and racing repo checkouts, so the app MUST run with a
-# single worker (enforced at the ASGI/systemd layer, see `just serve` and epic #2).
+# In-memory index model: `app.state.index_holder` holds the live view of the rulings, never
+# mutated: an approval swaps a new one in, as a new generation each request pins (api.pinned).
+# Each worker has its own repo checkout and index, kept on the latest version by the cluster
+# module (snapshots shared between workers, NOTIFY on approval), so the app can run with several
+# workers. The cards and first index may be preloaded before the workers fork (`rulings-web
+# serve --preload`, see preload). The worker loads in the background, answering what does not
+# need the index meanwhile (see health and while_loading).
 @contextlib.asynccontextmanager
 async def lifespan(app: FastAPI):
-    app.state.cards_map = await asgiref.sync.SyncToAsync(krcg.loader.load_local)()
+    app.state.health = health.Health()
+    app.state.response_cache = cache.ResponseCache(api.RESPONSE_CACHE_BYTES)
+    app.state.page_cache = cache.ResponseCache(PAGE_CACHE_BYTES)
+    app.state.fragment_cache = cache.ResponseCache(PAGE_CACHE_BYTES)
+    app.state.events = events.Broadcaster()
     async with aiofiles.tempfile.TemporaryDirectory() as repo_dir, db.POOL:
+        loader = asyncio.create_task(warm_up(app, repo_dir))
+        if server.warming():
+            await loader  # a standby worker accepts once warmed up (see server)
+        try:
+            yield
+        finally:
+            loader.cancel()
+            if listener := getattr(app.state, "listener", None):
+                listener.cancel()
+
+
+async def warm_up(app: FastAPI, repo_dir: str) -> None:
+    """Load what the app serves, phase by phase (see health.PHASES), then follow the index
+    versions announced. A failed phase is retried after LOAD_RETRY_DELAY."""
+    state = app.state
+    while not state.health.ready:
+        try:
+            await warm_up_phases(app, os.path.join(repo_dir, "rulings"))
+        except Exception as err:
+            logger.exception("startup failed: %s", state.health.report(state)["phases"])
+            state.health.error = f"{err.__class__.__name__}: {err}"
+            await asyncio.sleep(LOAD_RETRY_DELAY)
+    state.listener = asyncio.create_task(cluster.listen(state))
+    logger.warning("Worker %d ready: %s", os.getpid(), server.memory())
+    await server.ready()
+
+
+async def warm_up_phases(app: FastAPI, repo_dir: str) -> None:
+    state = app.state
+    if "cards" not in state.health:
+        if not hasattr(state, "cards_map"):
+            state.cards_map = await asgiref.sync.SyncToAsync(krcg.loader.load_local)()
+            state.cards_completion = utils.CardCompletion(state.cards_map)
+            state.card_texts = await asgiref.sync.SyncToAsync(card_texts)(state.cards_map)
+        templates.env.globals["card_texts"] = state.card_texts
+        for name in templates.env.list_templates(extensions=["html"]):
+            templates.get_template(name)
+        state.health.done("cards")
+    if "database" not in state.health:
         logger.warning("Initializing database")
         await db.init()
+        await db.POOL.wait()
+        state.health.done("database")
+    if "repository" not in state.health:
         logger.warning("Using temporary repo: %s", repo_dir)
-        app.state.rulings_repo = await repository.clone(repo_dir)
-        app.state.rulings_index = await repository.load_base(
-            app.state.rulings_repo, app.state.cards_map
-        )
-        yield
+        if os.path.exists(repo_dir):  # left by a failed attempt
+            await asgiref.sync.SyncToAsync(shutil.rmtree)(repo_dir)
+        state.rulings_repo = await repository.clone(repo_dir)
+        state.health.done("repository")
+    if "index" not in state.health:
+        # the preloaded index stays referenced once swapped out: freeing it would unshare its pages
+        index = getattr(state, "preloaded_index", None)
+        if index is None or index.version != state.rulings_repo.head.commit.hexsha:
+            index = await cluster.load(state.rulings_repo, state.cards_map)
+        state.index_holder = cluster.IndexHolder(index)
+        state.changelog = changes.ChangeLog(api.CHANGES_RETENTION)
+        await state.changelog.record(index.version, index.hashes)
+        state.health.done("index")
 
 
 app = FastAPI(lifespan=lifespan, redirect_slashes=False)
@@ -59,6 +148,12 @@ app.include_router(api.router, prefix="/api")
 templates = Jinja2Templates(directory=os.path.join(PACKAGE_DIR, "templates"))
 
 
+def plain(obj):
+    """Models as plain data for the templates, the shape asdict() gives (enums as their value):
+    an orjson round trip, much cheaper than asdict() deep copying the object graph."""
+    return orjson.loads(orjson.dumps(obj))
+
+
 def external_link(name, url, anchor=None, class_=None, params=None):
     if params:
         url += "?" + urllib.parse.urlencode(params)
@@ -68,21 +163,29 @@ def external_link(name, url, anchor=None, class_=None, params=None):
     return markupsafe.Markup(f'<a {class_}target="_blank" href="{url}">{name}</a>')
 
 
+def marker_pattern(markers: typing.Iterable[str]) -> re.Pattern:
+    """One alternation of literal markers, the longest first, for a single substitution pass."""
+    return re.compile("|".join(re.escape(m) for m in sorted(markers, key=len, reverse=True)))
+
+
+def symbol_span(text: str, symbol: str) -> str:
+    return (
+        f'<span class="krcg-icon" contenteditable="false"'
+        f' data-marker="{markupsafe.escape(text)}">{symbol}</span>'
+    )
+
+
 def symbol_replace(s: str, d: list):
     """Owns the escaping for the author-supplied chains it heads: `s` is author-supplied and what it
     returns is `| safe`. escape() is a no-op on Markup, so a caller that escaped already (ruling_body,
     card_text — which must inject its own markup first) hands one in rather than double-escaping."""
-    esc = markupsafe.escape
-    s = str(esc(s))
-    # one entry per *occurrence* comes in, and replace() is global: a repeated symbol must be
-    # deduped or the second pass rewrites the [pot] now sitting inside the injected data-marker
-    for text, symbol in {sub["text"]: sub["symbol"] for sub in d}.items():
-        s = s.replace(
-            text,
-            f'<span class="krcg-icon" contenteditable="false"'
-            f' data-marker="{esc(text)}">{symbol}</span>',
-        )
-    return s
+    s = str(markupsafe.escape(s))
+    # one entry per *occurrence* comes in: dedupe. A single pass never rescans what it injected,
+    # so the [pot] sitting inside a data-marker is left alone.
+    spans = {sub["text"]: symbol_span(sub["text"], sub["symbol"]) for sub in d}
+    if not spans:
+        return s
+    return marker_pattern(spans).sub(lambda match: spans[match.group(0)], s)
 
 
 def newlines(s: str):
@@ -180,21 +283,51 @@ def card_text(
     return markupsafe.Markup("<br>".join(out))
 
 
+def card_texts(card_map: krcg.collections.CardDict) -> dict[str, markupsafe.Markup]:
+    """The card_text() markup of every card, by uid: card text only changes with the card DB, so
+    it's rendered once at startup and the card page looks it up."""
+    manager = proposal.Manager(card_map, models.Index())
+    ret = {}
+    for card in card_map.cards():
+        data = plain(manager.get_card(card.id))
+        ret[data["uid"]] = card_text(
+            data["text"], data["types"], data["text_symbols"], data["cards"]
+        )
+    return ret
+
+
+#: Rendered ruling bodies by (uid, text), dropped whole when it reaches the cap.
+RULING_BODIES_CAP = 50_000
+_RULING_BODIES: dict[tuple[str, str], markupsafe.Markup] = {}
+
+
 def ruling_body(ruling: dict):
     """Resolve a ruling's text for read-mode SSR: glyphs, card spans, references stripped out.
     Text is proposal-authored, so escape it before injecting any markup — which means matching
-    the markers in their escaped form too."""
+    the markers in their escaped form too. Everything derives from the text, so the result is
+    memoized by ruling uid and text."""
+    key = (ruling.get("uid", ""), ruling["text"])
+    if key[0] and key in _RULING_BODIES:
+        return _RULING_BODIES[key]
     esc = markupsafe.escape
-    s = esc(ruling["text"])
-    for reference in ruling["references"]:  # before emphasis, see it for why
-        s = s.replace(str(esc(reference["text"])), "")
-    s = symbol_replace(emphasis(s), ruling["symbols"])
-    for text, card in {c["text"]: c for c in ruling["cards"]}.items():  # dedupe, see symbol_replace
-        s = s.replace(
-            str(esc(text)),
-            card_span(card, str(esc(card["printed_name"])), text),
-        )
-    return markupsafe.Markup(newlines(s.strip()))
+    s = str(esc(ruling["text"]))
+    references = {str(esc(reference["text"])) for reference in ruling["references"]}
+    if references:  # before emphasis, see it for why
+        s = marker_pattern(references).sub("", s)
+    s = str(emphasis(s))
+    # symbols and cards in one pass, deduped (see symbol_replace)
+    spans = {sub["text"]: symbol_span(sub["text"], sub["symbol"]) for sub in ruling["symbols"]}
+    for card in ruling["cards"]:
+        name = str(esc(card["printed_name"]))
+        spans[str(esc(card["text"]))] = card_span(card, name, card["text"])
+    if spans:
+        s = marker_pattern(spans).sub(lambda match: spans[match.group(0)], s)
+    ret = markupsafe.Markup(newlines(s.strip()))
+    if key[0]:
+        if len(_RULING_BODIES) >= RULING_BODIES_CAP:
+            _RULING_BODIES.clear()
+        _RULING_BODIES[key] = ret
+    return ret
 
 
 templates.env.globals["version"] = version  # ty: ignore[invalid-assignment]  # jinja globals dict
@@ -203,6 +336,10 @@ templates.env.globals["rulings_repo_url"] = repository.RULINGS_REPO_WEB  # ty: i
 templates.env.filters["symbolreplace"] = symbol_replace
 templates.env.filters["cardtext"] = card_text
 templates.env.filters["rulingbody"] = ruling_body
+#: Pages the catch-all route renders (the others are 404)
+PAGES = frozenset(
+    name for name in templates.env.list_templates(extensions=["html"]) if not name.startswith("_")
+)
 
 
 @app.exception_handler(404)
@@ -211,6 +348,53 @@ async def page_not_found(request: Request, error):
     return templates.TemplateResponse(request, "404.html", status_code=404)
 
 
+@app.middleware("http")
+async def while_loading(request: Request, call_next):
+    """Until the first index is loaded, what needs it is unavailable (503, retried by browsers
+    and load balancers). Static files, health checks and the 404 page are served meanwhile."""
+    state = request.app.state
+    path = request.url.path
+    if state.health.ready or path == "/" or path.startswith(LOADING_EXEMPT):
+        return await call_next(request)
+    if not path.startswith("/api/") and path.lstrip("/") not in PAGES:
+        return await page_not_found(request, None)
+    return Response(
+        "The rulings are loading, retry shortly.",
+        status_code=503,
+        headers={"Retry-After": str(int(LOAD_RETRY_DELAY)), "Cache-Control": "no-store"},
+        media_type="text/plain",
+    )
+
+
+@app.middleware("http")
+async def index_generation(request: Request, call_next):
+    """Tell which index a response was built from, if any: its version, the same on every worker,
+    and this worker's generation of it."""
+    response = await call_next(request)
+    generation = getattr(request.state, "generation", None)
+    if generation is not None:
+        response.headers["X-Index-Version"] = generation.index.version
+        response.headers["X-Index-Generation"] = str(generation.number)
+    return response
+
+
+@app.get("/healthz")
+async def healthz(request: Request):
+    """Liveness: the worker answers. Its startup phases and index generation, for monitoring."""
+    return JSONResponse(request.app.state.health.report(request.app.state))
+
+
+@app.get("/readyz")
+async def readyz(request: Request):
+    """Readiness: 503 until the first index is loaded, routed around by load balancers."""
+    state = request.app.state
+    return JSONResponse(
+        state.health.report(state),
+        status_code=200 if state.health.ready else 503,
+        headers={"Cache-Control": "no-store"},
+    )
+
+
 @app.exception_handler(ValueError)
 @app.exception_handler(KeyError)
 async def data_error(request: Request, error: Exception):
@@ -279,6 +463,15 @@ async def root():
 
 @app.get("/{page:path}")
 async def index(request: Request, page: str, user: db.User | None = Depends(api.get_current_user)):
+    # anonymous card and group pages only depend on the page, the uid and the index generation
+    generation = api.pinned(request)
+    rulings_index = generation.index
+    page_key = None
+    if user is None and page in CACHED_PAGES and rulings_index.version:
+        page_key = (page, request.query_params.get("uid", ""))
+        entry = request.app.state.page_cache.get(generation.number, page_key)
+        if entry is not None:
+            return cached_page(request, entry)
     context = {}
     prop_uid = request.query_params.get("prop", None)
     current_prop = None
@@ -339,49 +532,23 @@ async def index(request: Request, page: str, user: db.User | None = Depends(api.
         context["proposal"] = proposal_dict
         if prop.channel_id:
             context["proposal"]["url"] = discord.proposal_discussion_url(prop)
-        context["rbk_references"] = [
-            asdict(ref) for ref in manager.base.references.values() if ref.uid.startswith("RBK ")
-        ]
+        context["rbk_references"] = plain(
+            [ref for ref in manager.base.references.values() if ref.uid.startswith("RBK ")]
+        )
         context["search_params"] = f"?prop={prop.uid}"
         context["search_params_2"] = f"&prop={prop.uid}"
     else:
         context["search_params"] = ""
         context["search_params_2"] = ""
     if page == "groups.html":
-        context["groups"] = [asdict(g) for g in manager.all_groups(deleted=True)]
+        context["groups"] = plain(list(manager.all_groups(deleted=True)))
         uid = request.query_params.get("uid", None)
         if uid:
-            try:
-                current = asdict(manager.get_group(uid, deleted=True))
-                current["rulings"] = [asdict(r) for r in manager.get_rulings(uid, deleted=True)]
-                context["current"] = current
-                name = current["name"] or "Unnamed group"
-                context["page_title"] = f"{name} — V:TES Rulings"
-                context["og"] = {
-                    "title": name,
-                    "description": f"Official V:TES rulings for {name} — {len(current['cards'])} cards.",
-                    "url": f"{discord.SITE_URL_BASE.rstrip('/')}/groups.html?uid={uid}",
-                }
-            except KeyError:
-                raise HTTPException(404)
+            render_current(request, context, manager, page, uid, user)
     elif page == "index.html":
         uid = request.query_params.get("uid", None)
         if uid:
-            try:
-                current = asdict(manager.get_card(int(uid)))
-                current["rulings"] = [asdict(r) for r in manager.get_rulings(uid, deleted=True)]
-                current["backrefs"] = [asdict(b) for b in manager.get_backrefs(uid)]
-                context["current"] = current
-                name = current["printed_name"]
-                context["page_title"] = f"{name} — V:TES Rulings"
-                context["og"] = {
-                    "title": name,
-                    "description": f"Rulings and official clarifications for the V:TES card {name}.",
-                    "image": current["img"],
-                    "url": f"{discord.SITE_URL_BASE.rstrip('/')}/index.html?uid={uid}",
-                }
-            except KeyError:
-                raise HTTPException(404)
+            render_current(request, context, manager, page, uid, user)
         else:
             context["recent_changes"] = await repository.recent_changes(
                 request.app.state.rulings_repo
@@ -412,7 +579,7 @@ async def index(request: Request, page: str, user: db.User | None = Depends(api.
                     if p.usr != str(user.uid)
                 ]
         if current_prop is not None:
-            context["diff"] = asdict(manager.diff())
+            context["diff"] = plain(manager.diff())
     elif page == "admin.html":
         if not user or user.category != db.UserCategory.ADMIN:
             raise HTTPException(401)
@@ -421,7 +588,161 @@ async def index(request: Request, page: str, user: db.User | None = Depends(api.
             context["users"] = [await db.get_user(uuid.UUID(uid))]
         else:
             context["users"] = await db.get_50_users()
-    return templates.TemplateResponse(request, page, context)
+    response = templates.TemplateResponse(request, page, context)
+    if page_key is not None:
+        entry = request.app.state.page_cache.put(generation.number, page_key, response.body)
+        return cached_page(request, entry)
+    return response
+
+
+def current_group(manager: proposal.Manager, uid: str) -> tuple[dict, dict]:
+    """The current group for its page body, and the page head (title, link preview)."""
+    current = plain(manager.get_group(uid, deleted=True))
+    current["rulings"] = plain(list(manager.get_rulings(uid, deleted=True)))
+    name = current["name"] or "Unnamed group"
+    return current, {
+        "page_title": f"{name} — V:TES Rulings",
+        "og": {
+            "title": name,
+            "description": f"Official V:TES rulings for {name} — {len(current['cards'])} cards.",
+            "url": f"{discord.SITE_URL_BASE.rstrip('/')}/groups.html?uid={uid}",
+        },
+    }
+
+
+def current_card(manager: proposal.Manager, uid: str) -> tuple[dict, dict]:
+    """The current card for its page body, and the page head (title, link preview)."""
+    current = plain(manager.get_card(int(uid)))
+    current["rulings"] = plain(list(manager.get_rulings(uid, deleted=True)))
+    current["backrefs"] = plain(list(manager.get_backrefs(uid)))
+    name = current["printed_name"]
+    return current, {
+        "page_title": f"{name} — V:TES Rulings",
+        "og": {
+            "title": name,
+            "description": f"Rulings and official clarifications for the V:TES card {name}.",
+            "image": current["img"],
+            "url": f"{discord.SITE_URL_BASE.rstrip('/')}/index.html?uid={uid}",
+        },
+    }
+
+
+#: Pages showing a current card or group: the template of its body and how to build it.
+FRAGMENTS = {
+    "index.html": ("_card.html", current_card),
+    "groups.html": ("_group.html", current_group),
+}
+
+
+def render_current(
+    request: Request,
+    context: dict,
+    manager: proposal.Manager,
+    page: str,
+    uid: str,
+    user: db.User | None,
+) -> None:
+    """Put the current card or group body in the context, rendered once per index generation,
+    proposal version and logged-in state: only the per-user chrome around it renders each time."""
+    template, build = FRAGMENTS[page]
+    prop = manager.prop
+    key = (page, uid, prop.uid, prop.version, user is not None)
+    generation = api.pinned(request).number
+    fragment_cache: cache.ResponseCache = request.app.state.fragment_cache
+    entry = fragment_cache.get(generation, key)
+    if entry is None:
+        try:
+            current, head = build(manager, uid)
+        except KeyError:
+            raise HTTPException(404)
+        html = templates.get_template(template).render({**context, "current": current})
+        body = orjson.dumps({"html": html, "head": head})
+        entry = fragment_cache.put(generation, key, body)
+    fragment = orjson.loads(entry.body)
+    context["current"] = {"uid": uid}
+    context["current_html"] = markupsafe.Markup(fragment["html"])
+    context.update(fragment["head"])
+
+
+def cached_page(request: Request, entry: cache.Entry) -> Response:
+    """Validated on the ETag only: a deploy changes the page (templates, assets) as much as an
+    approval does, so the rulings commit date is no Last-Modified."""
+    headers = {
+        "ETag": entry.etag,
+        "Cache-Control": "no-cache",  # revalidate: an approval or a deploy changes the page
+    }
+    if cache.not_modified(entry, request.headers):
+        return Response(status_code=304, headers=headers)
+    return HTMLResponse(entry.body, headers=headers)
+
+
+def static_targets(manager: proposal.Manager) -> list[tuple[str, str, str]]:
+    """The (path, page, uid) of every card with rulings and every group, for the static export."""
+    base = manager.base
+    cards = {uid for uid, rulings in base.rulings.items() if rulings and uid.isdigit()}
+    cards |= {uid for uid, rulings in base.group_rulings.items() if rulings}
+    ret = [(f"cards/{uid}.html", "index.html", uid) for uid in sorted(cards, key=int)]
+    ret.extend((f"groups/{g.uid}.html", "groups.html", g.uid) for g in manager.all_groups())
+    return ret
+
+
+def static_source(manager: proposal.Manager) -> export.Source:
+    """Anonymous card and group pages, as the site serves them, for the static export."""
+    groups = plain(list(manager.all_groups(deleted=True)))
+    groups_key = export.digest(orjson.dumps(groups))
+
+    def source(page: str, uid: str):
+        template, build = FRAGMENTS[page]
+        current, head = build(manager, uid)
+        context = {"search_params": "", "search_params_2": "", **head}
+        if page == "groups.html":
+            context["groups"] = groups
+        data = orjson.dumps([version, groups_key, page, current, head])
+
+        def render() -> bytes:
+            html = templates.get_template(template).render({**context, "current": current})
+            context.update(current={"uid": uid}, current_html=markupsafe.Markup(html))
+            return export.static_links(templates.get_template(page).render(context).encode())
+
+        return data, render
+
+    return source
+
+
+def static_search(manager: proposal.Manager, targets: list[tuple[str, str, str]]) -> bytes:
+    """The exported pages by name, for a static search box."""
+    ret = []
+    for path, page, uid in targets:
+        if page == "groups.html":
+            name = manager.get_group(uid).name
+        else:
+            name = manager.get_base_card(int(uid)).printed_name
+        ret.append({"uid": uid, "name": name, "url": f"/{path}"})
+    return orjson.dumps(ret)
+
+
+def load_index(repo_dir: str) -> tuple[krcg.collections.CardDict, models.Index]:
+    """Cards and rulings index as the app loads them at startup, without the database. Leaves no
+    thread running (no SyncToAsync): the static export forks its workers afterwards."""
+    card_map = krcg.loader.load_local()
+    repo = repository.clone_sync(repo_dir)
+    return card_map, asyncio.run(repository.load_base(repo, card_map))
+
+
+def preload(state: State) -> None:
+    """Load what the lifespan would in each worker, once in the master (see server): the cards,
+    and the index of the remote HEAD. No thread pool must be left running for the workers to fork
+    from it: no SyncToAsync here."""
+    state.cards_map = krcg.loader.load_local()
+    state.cards_completion = utils.CardCompletion(state.cards_map)
+    state.card_texts = card_texts(state.cards_map)
+    with tempfile.TemporaryDirectory() as repo_dir:
+        repo = repository.clone_sync(repo_dir)
+        index = cluster.read_snapshot(repo.head.commit.hexsha) if repo.head.is_valid() else None
+        if index is None:
+            index = asyncio.run(repository.load_base(repo, state.cards_map))
+            cluster.write_snapshot(index)
+    state.preloaded_index = index
 
 
 @click.group()
@@ -438,3 +759,45 @@ def resetdb():
 @click.argument("username")
 def makeadmin(username: str):
     db.make_admin(username)
+
+
+@main.command()
+@click.option("-b", "--bind", default="127.0.0.1:5000", help="host:port to listen on")
+@click.option("-w", "--workers", default=1, help="Worker processes")
+@click.option("--preload", "preloaded", is_flag=True, help="Load cards and index before forking")
+@click.option("--pidfile", default="", help="Replace the process it names once warmed up")
+def serve(bind: str, workers: int, preloaded: bool, pidfile: str):
+    """Serve the app with forked workers, sharing the cards and index pages if preloaded.
+    Accepts once warmed up only, alongside the previous process, which is then stopped."""
+    preloader = functools.partial(preload, app.state) if preloaded else None
+    server.run(app, bind, workers, preloader, pidfile)
+
+
+@main.command("export-static")
+@click.argument("dest", type=click.Path(file_okay=False))
+@click.option("-j", "--jobs", default=0, help="Rendering processes (default: one per CPU)")
+@click.option("--gzip", "compress", is_flag=True, help="Write precompressed .gz files too")
+def export_static(dest: str, jobs: int, compress: bool):
+    """Pre-render every card and group page to DEST. Incremental: unchanged pages are skipped."""
+    with tempfile.TemporaryDirectory() as repo_dir:
+        card_map, index = load_index(repo_dir)
+    templates.env.globals["card_texts"] = card_texts(card_map)  # ty: ignore[invalid-assignment]
+    manager = proposal.ReadOnlyManager(card_map, index)
+    targets = static_targets(manager)
+    files = {"search.json": static_search(manager, targets)}
+    stats = export.export(dest, targets, static_source(manager), files, jobs, compress)
+    click.echo(
+        f"{index.version or 'working tree'}: {stats.written} written, "
+        f"{stats.unchanged} unchanged, {stats.removed} removed"
+    )
+
+
+@main.command("export-rulings")
+@click.argument("output", type=click.File("wb"), default="-")
+@click.option("--gzip", "compress", is_flag=True, help="Write it gzipped")
+def export_rulings(output: typing.BinaryIO, compress: bool):
+    """Write the whole resolved index as JSON to OUTPUT (stdout by default), as served by
+    /api/export/rulings.json."""
+    with tempfile.TemporaryDirectory() as repo_dir:
+        card_map, index = load_index(repo_dir)
+    output.write(export.corpus_entries(card_map, index)["gzip" if compress else "identity"].body)
@@ -1,19 +1,39 @@
 import dataclasses
+import email.utils
 import logging
+import typing
 import urllib.parse
 import uuid
 from dataclasses import asdict
 
+import asgiref.sync
 import fastapi
 import orjson
 import psycopg
 from fastapi import Depends, HTTPException, Request, Response
-from fastapi.responses import JSONResponse
-
-from . import db, discord, proposal, repository, scraper, utils
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from . import (
+    cache,
+    changes,
+    cluster,
+    db,
+    discord,
+    events,
+    export,
+    models,
+    proposal,
+    repository,
+    scraper,
+    utils,
+)
 
 logger = logging.getLogger()
 router = fastapi.APIRouter()
+#: Bound on the encoded /api/card and /api/group responses kept for the current index version.
+RESPONSE_CACHE_BYTES = 64 * 1024 * 1024
+#: Index versions the change feed can tell the changes since.
+CHANGES_RETENTION = 32
 
 
 async def get_current_user(request: Request) -> db.User | None:
@@ -49,12 +69,35 @@ async def get_params(request: Request) -> dict:
         return {}
 
 
+class DataclassResponse(Response):
+    """JSON encoded by orjson, which walks (pydantic) dataclasses natively: handlers return the
+    models as they are, without an asdict() deep copy nor FastAPI's jsonable_encoder pass.
+    Underscore attributes (internal indexes) are left out, as asdict() leaves out non-fields."""
+
+    media_type = "application/json"
+
+    def render(self, content: typing.Any) -> bytes:
+        return orjson.dumps(content)
+
+
+def fields(obj: typing.Any) -> dict[str, typing.Any]:
+    """The dataclass fields as a dict, to add keys to the response: nested models stay as is."""
+    return {field.name: getattr(obj, field.name) for field in dataclasses.fields(obj)}
+
+
+def pinned(request: Request) -> cluster.Generation:
+    """The index generation this request is served from, the same for its whole duration."""
+    if not hasattr(request.state, "generation"):
+        request.state.generation = request.app.state.index_holder.current
+    return request.state.generation
+
+
 def build_manager(request: Request, prop: proposal.Proposal | None = None) -> proposal.Manager:
-    return proposal.Manager(
-        request.app.state.cards_map,
-        request.app.state.rulings_index,
-        prop,
-    )
+    index = pinned(request).index
+    if prop is None:
+        # most requests: no overlay to merge, read the base index directly
+        return proposal.ReadOnlyManager(request.app.state.cards_map, index)
+    return proposal.Manager(request.app.state.cards_map, index, prop)
 
 
 @dataclasses.dataclass
@@ -91,8 +134,21 @@ async def proposal_update(request: Request):
         prop = proposal.Proposal(**prop)
         if prop.usr != str(user.uid) and user.category == db.UserCategory.BASIC:
             raise ValueError("You cannot modify someone else's proposal")
+        before = events.proposal_hashes(prop)
         yield ProposalCtx(request=request, conn=conn, prop=prop, user=user)
+        targets = events.changed(before, events.proposal_hashes(prop))
+        if targets:  # not for a check, or a name change: nothing rendered differs
+            prop.version += 1
         await db.update_proposal(conn, asdict(prop))
+    if not targets:
+        return
+    # committed: co-editors can refetch. Best-effort: the edit is saved, it must not fail now.
+    try:
+        await events.publish(
+            "proposal", {"uid": prop.uid, "version": prop.version, "targets": targets}
+        )
+    except Exception:
+        logger.exception("failed to publish the edit of proposal %s", prop.uid)
 
 
 async def proposal_readonly(request: Request) -> proposal.Manager:
@@ -107,6 +163,26 @@ async def proposal_readonly(request: Request) -> proposal.Manager:
     return build_manager(request, prop)
 
 
+def cached_json(
+    request: Request,
+    manager: proposal.Manager,
+    key: tuple,
+    build: typing.Callable[[], typing.Any],
+) -> typing.Any:
+    """Serve a base index response from the response cache, with a strong ETag. Responses seeing
+    a proposal are built every time: they change with each edit."""
+    if not isinstance(manager, proposal.ReadOnlyManager):
+        return DataclassResponse(build())
+    response_cache: cache.ResponseCache = request.app.state.response_cache
+    generation = pinned(request).number
+    entry = response_cache.get(generation, key)
+    if entry is None:
+        entry = response_cache.put(generation, key, orjson.dumps(build()))
+    if cache.not_modified(entry, request.headers):
+        return Response(status_code=304, headers={"ETag": entry.etag})
+    return Response(entry.body, media_type="application/json", headers={"ETag": entry.etag})
+
+
 def update_proposal_from_params(prop: proposal.Proposal, params: dict) -> None:
     if params.get("name", None):
         prop.name = params["name"].strip()
@@ -114,6 +190,10 @@ def update_proposal_from_params(prop: proposal.Proposal, params: dict) -> None:
         prop.description = params["description"].strip()
 
 
+#: Cap on the card name completion dropdown.
+COMPLETE_CAP = 10
+
+
 @router.get("/complete")
 async def complete_card(request: Request):
     """Card name completion, with IDs."""
@@ -121,7 +201,7 @@ async def complete_card(request: Request):
     if not text:
         raise HTTPException(404)
     text = urllib.parse.unquote(text)
-    ret = request.app.state.cards_map.complete(text)
+    ret = request.app.state.cards_completion.complete(text, COMPLETE_CAP)
     return [
         {"label": card.unique_name, "value": str(card.id), "printed_name": card.printed_name}
         for card in ret
@@ -142,7 +222,7 @@ async def search(request: Request, manager: proposal.Manager = Depends(proposal_
     q = text.lower()
     cards = [
         {"label": card.unique_name, "url": f"index.html?uid={card.id}"}
-        for card in request.app.state.cards_map.complete(text)[:SEARCH_CARD_CAP]
+        for card in request.app.state.cards_completion.complete(text, SEARCH_CARD_CAP)
     ]
     groups = []
     for group in manager.all_groups():
@@ -179,30 +259,190 @@ async def search(request: Request, manager: proposal.Manager = Depends(proposal_
 
 
 @router.get("/card/{card_id}")
-async def get_card(card_id: int, manager: proposal.Manager = Depends(proposal_readonly)):
-    ret = asdict(manager.get_card(card_id))
-    cid = str(card_id)
-    ret["rulings"] = [asdict(r) for r in manager.get_rulings(cid)]
-    ret["groups"] = [asdict(r) for r in manager.get_groups_of_card(cid)]
-    ret["backrefs"] = [asdict(r) for r in manager.get_backrefs(cid)]
-    return ret
+async def get_card(
+    card_id: int, request: Request, manager: proposal.Manager = Depends(proposal_readonly)
+):
+    def build():
+        ret = fields(manager.get_card(card_id))
+        cid = str(card_id)
+        ret["rulings"] = list(manager.get_rulings(cid))
+        ret["groups"] = list(manager.get_groups_of_card(cid))
+        ret["backrefs"] = list(manager.get_backrefs(cid))
+        return ret
+
+    return cached_json(request, manager, ("card", card_id), build)
 
 
 @router.get("/group")
 async def list_groups(manager: proposal.Manager = Depends(proposal_readonly)):
-    return [asdict(g) for g in manager.all_groups()]
+    return DataclassResponse(list(manager.all_groups()))
 
 
 @router.get("/group/{group_id}")
-async def get_group(group_id: str, manager: proposal.Manager = Depends(proposal_readonly)):
-    try:
-        ret = asdict(manager.get_group(group_id))
-        ret["rulings"] = [asdict(r) for r in manager.get_rulings(group_id)]
+async def get_group(
+    group_id: str, request: Request, manager: proposal.Manager = Depends(proposal_readonly)
+):
+    def build():
+        ret = fields(manager.get_group(group_id))
+        ret["rulings"] = list(manager.get_rulings(group_id))
         return ret
+
+    try:
+        return cached_json(request, manager, ("group", group_id), build)
     except KeyError:
         raise HTTPException(404)
 
 
+@router.get("/export/rulings.json")
+async def export_rulings(request: Request):
+    """The whole resolved index for downstream tools, built once per index version and served
+    precompressed: a rebuild after each approval is one conditional GET."""
+    index = pinned(request).index
+    entries = await asgiref.sync.SyncToAsync(export.corpus_entries)(
+        request.app.state.cards_map, index
+    )
+    gzipped = cache.accepts_encoding(request.headers, "gzip")
+    entry = entries["gzip" if gzipped else "identity"]
+    headers = {"ETag": entry.etag, "Vary": "Accept-Encoding", "Cache-Control": "no-cache"}
+    if index.committed_at:
+        headers["Last-Modified"] = email.utils.formatdate(index.committed_at, usegmt=True)
+    if cache.not_modified(entry, request.headers, index.committed_at):
+        return Response(status_code=304, headers=headers)
+    if gzipped:
+        headers["Content-Encoding"] = "gzip"
+    return Response(entry.body, media_type="application/json", headers=headers)
+
+
+@router.get("/changes")
+async def get_changes(request: Request):
+    """What changed since an index version (or commit sha prefix): the rulings targets, groups and
+    references added or modified, with their content, and the uids deleted. Past the versions
+    kept, a full resync from /api/export/rulings.json is required."""
+    since = request.query_params.get("since", "")
+    if not since:
+        raise ValueError("since is required")
+    state = request.app.state
+    manager = build_manager(request)
+    found = await state.changelog.find(since)
+
+    def build():
+        index = manager.base
+        if found is None:
+            return {
+                "version": index.version,
+                "full_resync": True,
+                "export": "/api/export/rulings.json",
+            }
+        current = changes.by_uid(export.index_corpus(state.cards_map, index))
+        delta = index.hashes.diff(found[1])
+        ret = {"version": index.version, "since": found[0], "full_resync": False}
+        for kind, uids in delta.items():
+            ret[kind] = {
+                "added": {uid: current[kind][uid] for uid in uids["added"]},
+                "modified": {uid: current[kind][uid] for uid in uids["modified"]},
+                "deleted": uids["deleted"],
+            }
+        return ret
+
+    # one entry for every version not kept: a key per unknown `since` would let anyone fill
+    # the cache
+    key = ("changes", found[0] if found else None)
+    return cached_json(request, manager, key, build)
+
+
+@router.get("/status")
+async def get_status(request: Request):
+    """This worker: node, index version and generation (bumped on each swap), and the version
+    it is loading if any."""
+    return cluster.status(request.app.state)
+
+
+@router.get("/events")
+async def get_events(request: Request):
+    """Server-sent events: `index` when an approval swaps the index, `proposal` when the proposal
+    given as `prop` is edited, each with the new version and the uids of the targets, groups and
+    references changed, for the client to refetch only those, or `reset` to refetch everything.
+    The ids are the same on every worker. The proposal must be the one opened in the session
+    (see index), by a logged-in user."""
+    prop_uid = request.query_params.get("prop", "")
+    if prop_uid:
+        if not await get_current_user(request):
+            raise HTTPException(401)
+        if prop_uid != request.session.get("proposal", None):
+            raise HTTPException(403)
+    last_event_id = request.headers.get("last-event-id", "")
+    stream = request.app.state.events.stream(
+        int(last_event_id) if last_event_id.isdigit() else None, prop_uid
+    )
+    return StreamingResponse(
+        stream,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},  # nginx: no buffering
+    )
+
+
+#: Cap on the distinct cards of a decklist
+DECK_CAP = 300
+
+
+def card_rulings(manager: proposal.Manager, uid: str) -> list[models.Ruling]:
+    """A card's rulings, its groups' included: kept per index when read from the base alone."""
+    if not isinstance(manager, proposal.ReadOnlyManager):
+        return list(manager.get_rulings(uid))
+    memo = manager.base.memo("card_rulings")
+    if uid not in memo:
+        memo[uid] = list(manager.get_rulings(uid))
+    return memo[uid]
+
+
+@router.post("/deck/rulings")
+async def deck_rulings(request: Request, manager: proposal.Manager = Depends(proposal_readonly)):
+    """The rulings of a deck's cards in one request, from a decklist (`decklist`, or a plain text
+    body) or card IDs (`cards`). A ruling is listed once, with the deck cards it applies to and the
+    ones it mentions: group rulings as each card sees them (prefix, override), so a group ruling
+    adapted to a card is listed apart."""
+    card_map = request.app.state.cards_map
+    if request.headers.get("content-type", "").startswith("text/plain"):
+        params = {"decklist": (await request.body()).decode("utf-8", errors="replace")}
+    else:
+        params = await get_params(request)
+    unknown = []
+    if params.get("decklist"):
+        deck, unknown = utils.parse_decklist(card_map, str(params["decklist"]))
+    elif params.get("cards"):
+        deck = {}
+        for card_id in params["cards"]:
+            card = card_map[int(card_id)]
+            deck[card.id] = deck.get(card.id, 0) + 1
+    else:
+        raise ValueError("A decklist or card IDs are required")
+    if len(deck) > DECK_CAP:
+        raise ValueError(f"A deck has at most {DECK_CAP} different cards")
+    uids = [str(card_id) for card_id in deck]
+    entries: dict[tuple[str, str, str], dict[str, typing.Any]] = {}
+    for uid in uids:
+        for ruling in card_rulings(manager, uid):
+            key = (ruling.target.uid, ruling.uid, ruling.text)
+            if key not in entries:
+                mentioned = {card.uid for card in ruling.cards}
+                entries[key] = {
+                    "ruling": ruling,
+                    "cards": [],
+                    "mentions": [uid for uid in uids if uid in mentioned],
+                }
+            entries[key]["cards"].append(uid)
+    return DataclassResponse(
+        {
+            "cards": [
+                fields(manager.get_base_card(card_id)) | {"count": count}
+                for card_id, count in deck.items()
+            ],
+            "unknown": unknown,
+            "rulings": list(entries.values()),
+        }
+    )
+
+
 @router.post("/proposal")
 async def start_proposal(request: Request, user: db.User = Depends(require_user)):
     prop = proposal.Proposal(uid=utils.random_uid8(), usr=str(user.uid))
@@ -249,34 +489,47 @@ async def approve_proposal(ctx: ProposalCtx = Depends(proposal_update)):
     if not ctx.prop.channel_id:
         raise ValueError("Proposal must be submitted first")
     state = ctx.request.app.state
-    diff = ctx.manager.diff()
-    index = ctx.manager.merge()
-    await repository.commit_index(
-        state.rulings_repo,
-        state.cards_map,
-        index,
-        f"{ctx.prop.name}\n\n{ctx.prop.description}",
-    )
-    # Point of no return (pushed): delete + commit now so a later best-effort failure can't orphan
-    # the row. The post-yield update_proposal in proposal_update then no-ops (row gone).
-    await db.delete_proposal(ctx.conn, asdict(ctx.prop))
-    await ctx.conn.commit()
-    ctx.request.session.pop("proposal", None)
-    # Best-effort follow-ups: an announcement or index-reload failure must not resurrect the proposal.
+    # One approval at a time across workers, each merged on the latest version: the lock is held
+    # until the proposal deletion commits, after the push. This worker's checkout is held from
+    # the catch-up to the swap: following another version meanwhile would reset it.
+    await db.advisory_xact_lock(ctx.conn, cluster.APPROVAL_LOCK)
+    async with cluster.CHECKOUT_LOCK:
+        await cluster.catch_up(state)
+        ctx.request.state.generation = state.index_holder.current  # merge on it, not the pinned
+        diff = ctx.manager.diff()
+        index = ctx.manager.merge()
+        await repository.commit_index(
+            state.rulings_repo,
+            state.cards_map,
+            index,
+            f"{ctx.prop.name}\n\n{ctx.prop.description}",
+        )
+        # Point of no return (pushed): delete + commit now so a later best-effort failure can't
+        # orphan the row. The post-yield update_proposal in proposal_update then no-ops (row gone).
+        await db.delete_proposal(ctx.conn, asdict(ctx.prop))
+        await ctx.conn.commit()
+        ctx.request.session.pop("proposal", None)
+        # Best-effort follow-ups: an index-reload failure must not resurrect the proposal.
+        try:
+            index = await cluster.load(state.rulings_repo, state.cards_map)
+            previous = await cluster.swap(state, index)
+            await cluster.announce(index.version)
+            await events.publish(
+                "index",
+                {"version": index.version, "targets": events.index_changes(previous, index)},
+            )
+        except Exception:
+            logger.exception("failed to reload the rulings index after approving %s", ctx.prop.uid)
     try:
         await discord.proposal_approved(ctx.prop, diff)
     except Exception:
         logger.exception("failed to announce approval on Discord for proposal %s", ctx.prop.uid)
-    try:
-        state.rulings_index = await repository.load_base(state.rulings_repo, state.cards_map)
-    except Exception:
-        logger.exception("failed to reload rulings index after approving proposal %s", ctx.prop.uid)
     return {}
 
 
 @router.get("/reference")
 async def get_reference(manager: proposal.Manager = Depends(proposal_readonly)):
-    return [asdict(ref) for ref in manager.all_references()]
+    return DataclassResponse(list(manager.all_references()))
 
 
 @router.post("/reference/search")
@@ -289,7 +542,7 @@ async def search_reference(
             ret = manager.get_reference(params.get("uid", ""))
         else:
             ret = manager.get_reference_by_url(params.get("url", ""))
-        return {"reference": asdict(ret)}
+        return DataclassResponse({"reference": ret})
     except KeyError:
         if params.get("url", "").startswith("https://www.vekn.net/forum/"):
             try:
@@ -300,40 +553,52 @@ async def search_reference(
         raise HTTPException(404)
 
 
+@router.get("/reference/{reference_id}/rulings")
+async def get_reference_rulings(
+    reference_id: str, manager: proposal.Manager = Depends(proposal_readonly)
+):
+    """The rulings citing a reference."""
+    try:
+        manager.get_reference(reference_id)
+    except KeyError:
+        raise HTTPException(404)
+    return DataclassResponse(list(manager.get_citations(reference_id)))
+
+
 @router.post("/reference")
 async def post_reference(ctx: ProposalCtx = Depends(proposal_update)):
     params = await get_params(ctx.request)
-    return asdict(ctx.manager.insert_reference(**params))
+    return DataclassResponse(ctx.manager.insert_reference(**params))
 
 
 @router.put("/reference/{reference_id}")
 async def put_reference(reference_id: str, ctx: ProposalCtx = Depends(proposal_update)):
     params = await get_params(ctx.request)
-    return asdict(ctx.manager.update_reference(reference_id, **params))
+    return DataclassResponse(ctx.manager.update_reference(reference_id, **params))
 
 
 @router.get("/check-consistency")
 async def check_consistency(ctx: ProposalCtx = Depends(proposal_update)):
-    return [asdict(e) for e in ctx.manager.check_consistency()]
+    return DataclassResponse(ctx.manager.check_consistency())
 
 
 @router.post("/ruling/{target_id}")
 async def post_ruling(target_id: str, ctx: ProposalCtx = Depends(proposal_update)):
     params = await get_params(ctx.request)
-    return asdict(ctx.manager.insert_ruling(target_id, **params))
+    return DataclassResponse(ctx.manager.insert_ruling(target_id, **params))
 
 
 @router.put("/ruling/{target_id}/{ruling_id}")
 async def put_ruling(target_id: str, ruling_id: str, ctx: ProposalCtx = Depends(proposal_update)):
     params = await get_params(ctx.request)
-    return asdict(ctx.manager.update_ruling(target_id, ruling_id, **params))
+    return DataclassResponse(ctx.manager.update_ruling(target_id, ruling_id, **params))
 
 
 @router.post("/ruling/{target_id}/{ruling_id}/restore")
 async def restore_ruling(
     target_id: str, ruling_id: str, ctx: ProposalCtx = Depends(proposal_update)
 ):
-    return asdict(ctx.manager.restore_ruling(target_id, ruling_id))
+    return DataclassResponse(ctx.manager.restore_ruling(target_id, ruling_id))
 
 
 @router.delete("/ruling/{target_id}/{ruling_id}")
@@ -343,7 +608,7 @@ async def delete_ruling(
     ret = ctx.manager.delete_ruling(target_id, ruling_id)
     if ret is None:
         return Response(status_code=200)
-    return asdict(ret)
+    return DataclassResponse(ret)
 
 
 @router.put("/ruling/{target_id}/{ruling_id}/override/{card_id}")
@@ -352,7 +617,7 @@ async def put_override(
 ):
     """Set (empty text clears) a per-card text override on a group ruling. See pst #27."""
     params = await get_params(ctx.request)
-    return asdict(
+    return DataclassResponse(
         ctx.manager.override_ruling(target_id, ruling_id, card_id, params.get("text", ""))
     )
 
@@ -360,25 +625,25 @@ async def put_override(
 @router.post("/group")
 async def post_group(ctx: ProposalCtx = Depends(proposal_update)):
     params = await get_params(ctx.request)
-    return asdict(ctx.manager.insert_group(**params))
+    return DataclassResponse(ctx.manager.insert_group(**params))
 
 
 @router.put("/group/{group_id}")
 async def put_group(group_id: str, ctx: ProposalCtx = Depends(proposal_update)):
     params = await get_params(ctx.request)
-    return asdict(ctx.manager.update_group(uid=group_id, **params))
+    return DataclassResponse(ctx.manager.update_group(uid=group_id, **params))
 
 
 @router.post("/group/{group_id}/restore")
 async def restore_group(group_id: str, ctx: ProposalCtx = Depends(proposal_update)):
-    return asdict(ctx.manager.restore_group(group_id))
+    return DataclassResponse(ctx.manager.restore_group(group_id))
 
 
 @router.post("/group/{group_id}/restore/{card_id}")
 async def restore_group_card(
     group_id: str, card_id: str, ctx: ProposalCtx = Depends(proposal_update)
 ):
-    return asdict(ctx.manager.restore_group_card(group_id, card_id))
+    return DataclassResponse(ctx.manager.restore_group_card(group_id, card_id))
 
 
 @router.delete("/group/{group_id}")
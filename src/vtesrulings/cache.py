@@ -0,0 +1,105 @@
+"""Responses kept in memory for one generation of the rulings index (see cluster.IndexHolder).
+
+What is built from the base index alone (no proposal) only changes when a proposal is approved:
+the encoded bytes are kept per index generation, the first request of a new generation drops them
+all. A request pinned to an older generation (started before a swap) is served uncached.
+"""
+
+import collections
+import dataclasses
+import email.utils
+import hashlib
+import typing
+
+
+@dataclasses.dataclass(frozen=True)
+class Entry:
+    body: bytes
+    etag: str
+
+
+def etag(body: bytes) -> str:
+    """A strong ETag: the body hash."""
+    return f'"{hashlib.blake2b(body, digest_size=12).hexdigest()}"'
+
+
+def not_modified(entry: Entry, headers: typing.Mapping[str, str], last_modified: int = 0) -> bool:
+    """Whether the request conditional headers match the entry (RFC 9110): If-None-Match (weak
+    comparison) or, without it, If-Modified-Since against the last_modified timestamp."""
+    if_none_match = headers.get("if-none-match")
+    if if_none_match:
+        if if_none_match.strip() == "*":
+            return True
+        return any(tag.strip().removeprefix("W/") == entry.etag for tag in if_none_match.split(","))
+    if_modified_since = headers.get("if-modified-since")
+    if last_modified and if_modified_since:
+        try:
+            return email.utils.parsedate_to_datetime(if_modified_since).timestamp() >= last_modified
+        except (TypeError, ValueError):
+            return False  # invalid date: ignore the header
+    return False
+
+
+def accepts_encoding(headers: typing.Mapping[str, str], coding: str) -> bool:
+    """Whether the request Accept-Encoding allows the content coding (RFC 9110): listed, or
+    matched by `*`, with a non-zero q-value."""
+    qvalues = {}
+    for item in headers.get("accept-encoding", "").split(","):
+        name, _, params = item.partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0  # invalid q-value: ignore the coding
+        qvalues[name.strip().lower()] = q
+    return qvalues.get(coding, qvalues.get("*", 0.0)) > 0
+
+
+class ResponseCache:
+    """LRU of encoded responses for the current index generation, bounded by their size in bytes."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.generation = 0
+        self.size = 0
+        self._entries: collections.OrderedDict[typing.Hashable, Entry] = collections.OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _current(self, generation: int) -> bool:
+        """Whether entries of this generation are kept: a newer one drops the older entries."""
+        if generation > self.generation:
+            self.clear()
+            self.generation = generation
+        return generation == self.generation
+
+    def get(self, generation: int, key: typing.Hashable) -> Entry | None:
+        if not self._current(generation):
+            return None
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def put(self, generation: int, key: typing.Hashable, body: bytes) -> Entry:
+        """Cache the body, evicting the least recently used entries to stay under the bound."""
+        entry = Entry(body=body, etag=etag(body))
+        if not self._current(generation) or len(body) > self.max_bytes:
+            return entry  # stale, or would evict everything else
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self.size -= len(previous.body)
+        self._entries[key] = entry
+        self.size += len(body)
+        while self.size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= len(evicted.body)
+        return entry
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.size = 0
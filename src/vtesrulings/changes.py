@@ -0,0 +1,92 @@
+"""Change feed between index versions, for mirrors (bots, deckbuilders, krcg-static).
+
+The content hashes of each index version loaded (see models.ContentHashes) are kept: diffing the
+hashes of the version a mirror has with the current ones tells what it must fetch. They are kept
+in the database, so that every worker and the next deploy know the versions any of them loaded.
+Only the last versions are kept: past them, a mirror must resync fully from the export.
+"""
+
+import collections
+import re
+import typing
+
+from . import db, models
+
+#: Shortest commit sha prefix accepted for a version
+MIN_PREFIX = 7
+RE_VERSION = re.compile(r"^[0-9a-f]+$")
+
+
+def by_uid(corpus: dict[str, typing.Any]) -> dict[str, dict[str, typing.Any]]:
+    """The corpus items by kind then uid: rulings are by target already."""
+    return {
+        "rulings": corpus["rulings"],
+        "groups": {group.uid: group for group in corpus["groups"]},
+        "references": {reference.uid: reference for reference in corpus["references"]},
+    }
+
+
+def encode(hashes: models.ContentHashes) -> dict[str, typing.Any]:
+    """The hashes as JSON, hexadecimal."""
+    return {
+        "items": {
+            kind: {uid: digest.hex() for uid, digest in items.items()}
+            for kind, items in hashes.items.items()
+        },
+        "kinds": {kind: digest.hex() for kind, digest in hashes.kinds.items()},
+        "root": hashes.root.hex(),
+    }
+
+
+def decode(data: dict[str, typing.Any]) -> models.ContentHashes:
+    return models.ContentHashes(
+        items={
+            kind: {uid: bytes.fromhex(digest) for uid, digest in items.items()}
+            for kind, items in data["items"].items()
+        },
+        kinds={kind: bytes.fromhex(digest) for kind, digest in data["kinds"].items()},
+        root=bytes.fromhex(data["root"]),
+    )
+
+
+class ChangeLog:
+    """The hashes of the last index versions loaded, oldest dropped first: recorded in the
+    database, and in memory for the versions this worker recorded or looked up."""
+
+    def __init__(self, retention: int):
+        self.retention = retention
+        self._versions: collections.OrderedDict[str, models.ContentHashes] = (
+            collections.OrderedDict()
+        )
+
+    def __len__(self) -> int:
+        return len(self._versions)
+
+    def __contains__(self, version: str) -> bool:
+        return version in self._versions
+
+    def _keep(self, version: str, hashes: models.ContentHashes) -> None:
+        self._versions[version] = hashes
+        self._versions.move_to_end(version)
+        while len(self._versions) > self.retention:
+            self._versions.popitem(last=False)
+
+    async def record(self, version: str, hashes: models.ContentHashes) -> None:
+        if not version:
+            return  # an uncommitted working tree: no version to sync from
+        self._keep(version, hashes)
+        await db.record_index_version(version, encode(hashes), self.retention)
+
+    async def find(self, since: str) -> tuple[str, models.ContentHashes] | None:
+        """The version and hashes for a version or an unambiguous commit sha prefix of one."""
+        if since in self._versions:
+            return since, self._versions[since]
+        if len(since) < MIN_PREFIX or not RE_VERSION.match(since):
+            return None
+        found = await db.get_index_versions(since)  # other workers' versions too
+        if len(found) != 1:
+            return None
+        version, data = found[0]
+        if version not in self._versions:
+            self._keep(version, decode(data))
+        return version, self._versions[version]
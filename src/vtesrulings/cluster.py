@@ -0,0 +1,293 @@
+"""Several workers, on one node or more, serving the same rulings.
+
+Each worker keeps its own checkout of the rulings repository (any of them may approve), but an
+index is built once per version: the first worker needing it parses the YAML (load_base) and
+leaves a JSON snapshot the others load instead, in a directory private to the app user. Approvals are serialized by a Postgres
+advisory lock and announce the new version on a NOTIFY channel: every worker listening fetches
+that commit in the background and swaps the new index in. The index is never mutated: a swap
+replaces it whole in the IndexHolder, as a new generation (shown by /api/status).
+
+The server-sent events are relayed to every worker on another channel (see relay). The approver
+publishes the index event: a worker holds it back, the events after it too, until it serves that
+version, so a client told to refetch gets the new version from whichever worker answers.
+"""
+
+import asyncio
+import collections
+import dataclasses
+import importlib.metadata
+import logging
+import os
+import socket
+import stat
+import tempfile
+import time
+
+import asgiref.sync
+import git
+import krcg.collections
+import orjson
+import pydantic
+from starlette.datastructures import State
+
+from . import db, events, models, repository, server
+
+logger = logging.getLogger()
+#: This node name, for the status
+NODE = os.getenv("NODE_NAME") or socket.gethostname()
+#: Where the workers of this node leave their index snapshots, see snapshot_dir. By default in
+#: the state directory systemd gives the unit (StateDirectory=), or the user's.
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR") or os.path.join(
+    os.getenv("STATE_DIRECTORY", "").split(":")[0]
+    or os.path.join(
+        os.getenv("XDG_STATE_HOME") or os.path.expanduser("~/.local/state"), "vtes-rulings"
+    ),
+    "snapshots",
+)
+#: Snapshots kept in SNAPSHOT_DIR, the oldest are removed
+SNAPSHOTS_KEPT = 4
+#: Version of the snapshots content, in their names: bump it whenever models.Index or
+#: repository.load_base changes what an index holds. The package version does not change between
+#: development commits, and fields missing from an older snapshot would silently get defaults.
+INDEX_FORMAT = 1
+#: Advisory lock keys (app-wide, arbitrary)
+BUILD_LOCK = 0x52554C01
+APPROVAL_LOCK = 0x52554C02
+#: Seconds before listening again when the channel connection is lost
+RELISTEN_DELAY = 5.0
+#: Seconds an index event is held back at most, waiting for this worker to serve its version
+INDEX_EVENT_HOLD = 30.0
+#: Versions remembered as served or skipped, for the index events held back
+VERSIONS_PASSED = 16
+#: One move of this worker's checkout and index at a time: held to follow a version, and by an
+#: approval from its catch-up to its swap (a follow would reset the checkout it commits on)
+CHECKOUT_LOCK = asyncio.Lock()
+
+
+_INDEX = pydantic.TypeAdapter(models.Index)
+
+
+def snapshot_dir() -> str | None:
+    """SNAPSHOT_DIR, created private (0700) if missing. None if it is not a directory of this
+    user that only this user can access: the snapshots are trusted, so are not used then."""
+    os.makedirs(SNAPSHOT_DIR, mode=0o700, exist_ok=True)
+    info = os.lstat(SNAPSHOT_DIR)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        logger.error("not using the snapshot directory %s: not private to this user", SNAPSHOT_DIR)
+        return None
+    return SNAPSHOT_DIR
+
+
+def snapshot_path(directory: str, version: str) -> str:
+    # the format, code and card data versions too: a deploy must not load the snapshots of the
+    # previous one, and the index embeds card data (names, texts)
+    code = importlib.metadata.version("vtes-rulings")
+    cards = importlib.metadata.version("krcg")
+    return os.path.join(directory, f"{version}-f{INDEX_FORMAT}-{code}-krcg{cards}.json")
+
+
+def write_snapshot(index: models.Index) -> None:
+    """Leave the index for the other workers, atomically (they may be reading)."""
+    if not index.version:
+        return  # an uncommitted working tree: nothing another worker could check out
+    directory = snapshot_dir()
+    if directory is None:
+        return
+    with tempfile.NamedTemporaryFile(dir=directory, suffix=".tmp", delete=False) as f:
+        f.write(_INDEX.dump_json(index))
+    os.replace(f.name, snapshot_path(directory, index.version))
+    snapshots = sorted(
+        (entry for entry in os.scandir(directory) if entry.name.endswith(".json")),
+        key=lambda entry: entry.stat().st_mtime,
+    )
+    for entry in snapshots[:-SNAPSHOTS_KEPT]:
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:
+            pass  # another worker pruned it
+
+
+def read_snapshot(version: str) -> models.Index | None:
+    directory = snapshot_dir()
+    if directory is None:
+        return None
+    try:
+        with open(snapshot_path(directory, version), "rb") as f:
+            return _INDEX.validate_json(f.read())
+    except FileNotFoundError:
+        return None
+    except Exception:
+        logger.warning("unreadable index snapshot for %s: rebuilding it", version, exc_info=True)
+        return None
+
+
+async def load(repo: git.Repo, card_map: krcg.collections.CardDict) -> models.Index:
+    """The index of the checkout HEAD: its snapshot, or built (then snapshotted) by the first
+    worker needing it while the others wait for it."""
+    version = repo.head.commit.hexsha if repo.head.is_valid() else ""
+    read = asgiref.sync.SyncToAsync(read_snapshot)
+    if version and (index := await read(version)):
+        return index
+    async with db.advisory_lock(BUILD_LOCK):
+        if version and (index := await read(version)):
+            return index  # built while we waited
+        index = await repository.load_base(repo, card_map)
+        await asgiref.sync.SyncToAsync(write_snapshot)(index)
+    return index
+
+
+@dataclasses.dataclass(frozen=True)
+class Generation:
+    number: int
+    index: models.Index
+    loaded_at: float
+
+
+class IndexHolder:
+    """The index served. Each swap makes a new generation: its number, index and load time as one
+    object, replaced by one assignment. A request pins the generation current when it starts
+    (api.pinned) and is served from it to the end whatever swaps meanwhile: the previous index
+    lives on as long as requests pinned to it do."""
+
+    def __init__(self, index: models.Index):
+        self.current = Generation(1, index, time.time())
+        self.passed = collections.deque([index.version], maxlen=VERSIONS_PASSED)
+        self._swapped = asyncio.Event()
+
+    def swap(self, index: models.Index) -> Generation:
+        """Make the index current, returning the previous generation."""
+        previous = self.current
+        self.current = Generation(previous.number + 1, index, time.time())
+        self.passed.append(index.version)
+        self._swapped.set()
+        self._swapped = asyncio.Event()
+        return previous
+
+    def skip(self, version: str) -> None:
+        """The version will not be served: a later one was wanted before it was loaded."""
+        self.passed.append(version)
+
+    async def reached(self, version: str, timeout: float) -> bool:
+        """Wait until the version is served or skipped, at most timeout seconds."""
+        try:
+            async with asyncio.timeout(timeout):
+                while version not in self.passed:
+                    await self._swapped.wait()
+        except TimeoutError:
+            return False
+        return True
+
+
+async def swap(state: State, index: models.Index) -> models.Index:
+    """Serve the given index from now on: drop what was built from the previous one, returned."""
+    previous = state.index_holder.swap(index).index
+    state.response_cache.clear()
+    state.page_cache.clear()
+    state.fragment_cache.clear()
+    await state.changelog.record(index.version, index.hashes)
+    return previous
+
+
+async def follow(state: State, version: str = "") -> None:
+    """Move this worker to the given commit (the remote HEAD by default), if it is not there."""
+    async with CHECKOUT_LOCK:
+        await catch_up(state, version)
+
+
+async def catch_up(state: State, version: str = "") -> None:
+    """follow, CHECKOUT_LOCK being held."""
+    if version and version == state.index_holder.current.index.version:
+        return
+    head = await repository.fetch(state.rulings_repo, version)
+    if head != state.index_holder.current.index.version:
+        await swap(state, await load(state.rulings_repo, state.cards_map))
+
+
+async def announce(version: str) -> None:
+    await db.notify(db.INDEX_CHANNEL, version)
+
+
+class Follower:
+    """Loads the versions wanted one at a time, aside from the listener: of a burst of
+    announcements, only the last is loaded."""
+
+    def __init__(self, state: State):
+        self.state = state
+        self.wanted: str | None = None
+        self.loading: str | None = None
+        self._wake = asyncio.Event()
+
+    def want(self, version: str) -> None:
+        """Follow the given version, the remote HEAD if empty."""
+        if self.wanted:
+            self.state.index_holder.skip(self.wanted)
+        self.wanted = version
+        self._wake.set()
+
+    async def run(self) -> None:
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            self.loading, self.wanted = self.wanted, None
+            try:
+                await follow(self.state, self.loading or "")
+            except Exception:
+                logger.exception("failed to load the rulings index %s", self.loading or "HEAD")
+            finally:
+                self.loading = None
+
+
+async def listen(state: State) -> None:
+    """Follow the versions announced by the other workers and nodes, and relay the events, for
+    the app lifetime. Once (re)listening, catch up with the remote HEAD: announcements missed
+    meanwhile are lost."""
+    state.follower = Follower(state)
+    loader = asyncio.create_task(state.follower.run())
+    relayer = asyncio.create_task(relay(state))
+    try:
+        while True:
+            try:
+                async for version in db.listen(db.INDEX_CHANNEL):
+                    state.follower.want(version)
+            except Exception:
+                logger.exception("lost the rulings index channel, listening again")
+            await asyncio.sleep(RELISTEN_DELAY)
+    finally:
+        loader.cancel()
+        relayer.cancel()
+
+
+async def relay(state: State) -> None:
+    """Deliver the events published by any worker to this worker's streams, in order. An index
+    event is held back (the events after it too) until this worker serves its version or skips
+    it, INDEX_EVENT_HOLD at most. Once (re)listening, the events notified before are missed."""
+    while True:
+        try:
+            last_id = await db.last_event_id()  # before listening: a gap shows what is missed
+            async for payload in db.listen(db.EVENTS_CHANNEL):
+                if not payload:
+                    await state.events.resume(last_id)
+                    continue
+                event = events.Event(**orjson.loads(payload))
+                if event.kind == "index":
+                    await state.index_holder.reached(event.data["version"], INDEX_EVENT_HOLD)
+                await state.events.deliver(event)
+        except Exception:
+            logger.exception("lost the events channel, listening again")
+        await asyncio.sleep(RELISTEN_DELAY)
+
+
+def status(state: State) -> dict:
+    current = state.index_holder.current
+    follower: Follower | None = getattr(state, "follower", None)
+    return {
+        "node": NODE,
+        "pid": os.getpid(),
+        "generation": current.number,
+        "version": current.index.version,
+        "content_version": current.index.content_version,
+        "committed_at": current.index.committed_at,
+        "loaded_at": current.loaded_at,
+        "loading": follower.loading if follower else None,
+        "memory": server.memory(),
+    }
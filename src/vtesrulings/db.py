@@ -1,12 +1,15 @@
+import contextlib
 import dataclasses
 import enum
 import logging
 import os
+import typing
 import uuid
 
 import orjson
 import psycopg
 import psycopg.rows
+import psycopg.sql
 import psycopg.types.json
 import psycopg_pool
 
@@ -21,6 +24,15 @@ psycopg.types.json.set_json_dumps(orjson.dumps)
 psycopg.types.json.set_json_loads(orjson.loads)
 
 
+#: Channel new rulings index versions are announced on (payload: the commit sha), see cluster
+INDEX_CHANNEL = "rulings_index"
+#: Channel the server-sent events are relayed to every worker on (payload: the event as JSON,
+#: numbered by the event_ids sequence), see events
+EVENTS_CHANNEL = "rulings_events"
+#: Advisory lock key numbering the events in the order they are notified (app-wide, arbitrary)
+EVENTS_LOCK = 0x52554C03
+
+
 def reconnect_failed(_pool: psycopg_pool.AsyncConnectionPool):
     logger.error("Failed to reconnect to the PostgreSQL database")
 
@@ -62,11 +74,20 @@ async def init():
             "usr UUID REFERENCES users(uid), "
             "data json)"
         )
+        await cursor.execute(
+            "CREATE TABLE IF NOT EXISTS index_versions("
+            "version TEXT PRIMARY KEY, "
+            "recorded TIMESTAMPTZ NOT NULL DEFAULT now(), "
+            "hashes json)"
+        )
+        await cursor.execute("CREATE SEQUENCE IF NOT EXISTS event_ids")
 
 
 def reset():
     with psycopg.connect(CONNINFO) as conn, conn.cursor() as cursor:
         logger.warning("Reset DB")
+        cursor.execute("DROP TABLE IF EXISTS index_versions")
+        cursor.execute("DROP SEQUENCE IF EXISTS event_ids")
         cursor.execute("DROP TABLE proposals")
         cursor.execute("DROP TABLE users")
 
@@ -225,3 +246,79 @@ async def get_proposal_for_update(connection: psycopg.AsyncConnection, proposal_
             )
         ).fetchone()
     return ret[0] if ret else None
+
+
+async def record_index_version(version: str, hashes: dict, retention: int) -> None:
+    """Keep the content hashes of an index version, and of the `retention` last ones only."""
+    async with POOL.connection() as conn, conn.cursor() as cursor:
+        await cursor.execute(
+            "INSERT INTO index_versions (version, hashes) VALUES (%s, %s) "
+            "ON CONFLICT (version) DO UPDATE SET recorded=now()",
+            [version, psycopg.types.json.Json(hashes)],
+        )
+        await cursor.execute(
+            "DELETE FROM index_versions WHERE version NOT IN "
+            "(SELECT version FROM index_versions ORDER BY recorded DESC LIMIT %s)",
+            [retention],
+        )
+
+
+async def get_index_versions(prefix: str, limit: int = 2) -> list[tuple[str, dict]]:
+    """The versions starting with the prefix (hexadecimal: no LIKE wildcard), with their hashes."""
+    async with POOL.connection() as conn, conn.cursor() as cursor:
+        ret = await cursor.execute(
+            "SELECT version, hashes FROM index_versions WHERE version LIKE %s LIMIT %s",
+            [prefix + "%", limit],
+        )
+        return [(r[0], r[1]) for r in await ret.fetchall()]
+
+
+async def advisory_xact_lock(connection: psycopg.AsyncConnection, key: int) -> None:
+    """Wait for the advisory lock, held until the connection transaction ends."""
+    await connection.execute("SELECT pg_advisory_xact_lock(%s)", [key])
+
+
+@contextlib.asynccontextmanager
+async def advisory_lock(key: int) -> typing.AsyncGenerator[None]:
+    """Hold the advisory lock for the block, across processes and nodes."""
+    async with POOL.connection() as conn:
+        await conn.execute("SELECT pg_advisory_lock(%s)", [key])
+        try:
+            yield
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock(%s)", [key])
+
+
+async def notify(channel: str, payload: str) -> None:
+    async with POOL.connection() as conn:
+        await conn.execute("SELECT pg_notify(%s, %s)", [channel, payload])
+
+
+async def notify_event(kind: str, data: dict) -> None:
+    """Notify an event on EVENTS_CHANNEL, with the next id. The lock is held until the commit,
+    which sends the notification: the ids are in the order the listeners get the events."""
+    async with POOL.connection() as conn:
+        await advisory_xact_lock(conn, EVENTS_LOCK)
+        await conn.execute(
+            "SELECT pg_notify(%s, json_build_object("
+            "'id', nextval('event_ids'), 'kind', %s::text, 'data', %s::json)::text)",
+            [EVENTS_CHANNEL, kind, psycopg.types.json.Json(data)],
+        )
+
+
+async def last_event_id() -> int:
+    """The id of the last event notified, 0 if none was."""
+    async with POOL.connection() as conn:
+        ret = await (await conn.execute("SELECT last_value, is_called FROM event_ids")).fetchone()
+        return ret[0] if ret and ret[1] else 0
+
+
+async def listen(channel: str) -> typing.AsyncGenerator[str]:
+    """The payloads notified on the channel, on a dedicated connection: a pooled one would be
+    handed over to other requests. An empty payload comes first, once listening: what was
+    notified before is missed."""
+    async with await psycopg.AsyncConnection.connect(CONNINFO, autocommit=True) as conn:
+        await conn.execute(psycopg.sql.SQL("LISTEN {}").format(psycopg.sql.Identifier(channel)))
+        yield ""
+        async for notification in conn.notifies():
+            yield notification.payload
@@ -0,0 +1,149 @@
+"""Server-sent events: index swaps and proposal edits, for the pages kept open to refetch only
+what changed.
+
+An event is published to every worker over a NOTIFY channel (see publish), numbered by one
+database sequence: whichever worker a client reconnects to, its Last-Event-ID means the same.
+Each worker delivers the events relayed (see cluster.relay) to its streams, and keeps them in a
+short history so a client reconnecting with Last-Event-ID misses none. A connection costs a
+suspended coroutine waiting on one shared condition: idle, it only wakes to send a keepalive
+comment.
+"""
+
+import asyncio
+import collections
+import dataclasses
+import typing
+
+import orjson
+
+from . import db, models
+
+#: Seconds between keepalive comments on an idle stream (proxies drop silent connections)
+KEEPALIVE = 25.0
+#: Events kept for clients reconnecting with Last-Event-ID
+HISTORY = 256
+#: Largest event data relayed (NOTIFY payloads are capped at 8000 bytes): past it, a reset
+MAX_DATA = 7500
+#: Hashes by (kind, uid), see proposal_hashes
+ProposalHashes = dict[tuple[str, str], bytes]
+
+
+@dataclasses.dataclass(frozen=True)
+class Event:
+    id: int
+    kind: str  # "index", "proposal" or "reset"
+    data: dict[str, typing.Any]
+
+    def encode(self) -> bytes:
+        return b"id: %d\nevent: %s\ndata: %s\n\n" % (
+            self.id,
+            self.kind.encode(),
+            orjson.dumps(self.data),
+        )
+
+
+async def publish(kind: str, data: dict[str, typing.Any]) -> None:
+    """Publish an event to the streams of every worker. Too large to relay, it is a reset."""
+    if len(orjson.dumps(data)) > MAX_DATA:
+        kind, data = "reset", {}
+    await db.notify_event(kind, data)
+
+
+class Broadcaster:
+    """Delivers the events relayed to all the streams open, in order."""
+
+    def __init__(self, history: int = HISTORY, keepalive: float = KEEPALIVE):
+        self.keepalive = keepalive
+        self.last_id = 0
+        self._events: collections.deque[Event] = collections.deque(maxlen=history)
+        self._condition = asyncio.Condition()
+
+    async def deliver(self, event: Event) -> None:
+        """Deliver an event relayed, unless already delivered. Past a gap (events missed), the
+        history restarts from it: clients resuming from before the gap get a reset."""
+        async with self._condition:
+            if event.id <= self.last_id:
+                return
+            if event.id > self.last_id + 1:
+                self._events.clear()
+            self.last_id = event.id
+            self._events.append(event)
+            self._condition.notify_all()
+
+    async def resume(self, last_id: int) -> None:
+        """Start again from the given id, the last published (the relay listens again): the
+        events since are missed, the streams open get a reset."""
+        async with self._condition:
+            if last_id == self.last_id:
+                return
+            self._events.clear()
+            self.last_id = last_id
+            self._condition.notify_all()
+
+    async def stream(
+        self, last_id: int | None = None, proposal: str = ""
+    ) -> typing.AsyncGenerator[bytes]:
+        """The index events, and the events of the given proposal, from after last_id (from now
+        on by default). A client that missed more than the history holds, or ahead of it (this
+        worker has not relayed them yet), gets a reset event first: so does a stream open when
+        this worker misses events."""
+        missed = last_id is not None and not self._kept(last_id)
+        if last_id is None or missed:
+            last_id = self.last_id
+        yield b"retry: 5000\n\n"
+        if missed:
+            yield b"event: reset\ndata: {}\n\n"  # refetch everything
+        while True:
+            async with self._condition:
+                try:
+                    await asyncio.wait_for(
+                        self._condition.wait_for(lambda last_id=last_id: self.last_id != last_id),
+                        self.keepalive,
+                    )
+                except TimeoutError:
+                    events = []
+                else:
+                    missed = not self._kept(last_id)
+                    events = [event for event in self._events if event.id > last_id]
+                    last_id = self.last_id
+            if missed:
+                missed = False
+                yield b"event: reset\ndata: {}\n\n"
+                continue
+            if not events:
+                yield b": keepalive\n\n"
+                continue
+            for event in events:
+                if event.kind == "proposal" and event.data["uid"] != proposal:
+                    continue
+                yield event.encode()
+
+    def _kept(self, last_id: int) -> bool:
+        """Whether the events after last_id are all in the history."""
+        since = self._events[0].id - 1 if self._events else self.last_id
+        return since <= last_id <= self.last_id
+
+
+def proposal_hashes(prop: models.BaseIndex) -> ProposalHashes:
+    """A hash per rulings target, group and reference of a proposal, states included: what a
+    proposal edit changed is where they differ."""
+    ret = {}
+    for kind, items in zip(models.HASHED_KINDS, (prop.rulings, prop.groups, prop.references)):
+        for uid, item in items.items():
+            ret[kind, uid] = models.content_hash(repr(item))
+    return ret
+
+
+def changed(before: ProposalHashes, after: ProposalHashes) -> list[str]:
+    """The uids whose hash differs."""
+    keys = before.keys() | after.keys()
+    return sorted({uid for kind, uid in keys if before.get((kind, uid)) != after.get((kind, uid))})
+
+
+def index_changes(old: models.Index, new: models.Index) -> list[str]:
+    """The rulings targets, groups and references uids that differ between two indexes."""
+    ret = set()
+    for uids in new.hashes.diff(old.hashes).values():
+        for kind_uids in uids.values():
+            ret.update(kind_uids)
+    return sorted(ret)
@@ -0,0 +1,194 @@
+"""Exports of the rulings for what runs without the app: the whole resolved index as one JSON
+document for downstream tools (krcg-static, bots), and the read-only site for nginx or a CDN.
+
+In the static site, every card with rulings and every group gets its anonymous page written
+under `cards/` and `groups/` — `index.html?uid=<uid>` maps to `cards/<uid>.html`,
+`groups.html?uid=<uid>` to `groups/<uid>.html` — next to a `manifest.json` of what each file was
+rendered from. A later export only renders and writes the files whose source hash moved, and
+removes the ones gone. The links between pages point at those files (see static_links): nginx
+serves them, falling back to the app for the pages not exported (ansible/roles/static_export).
+"""
+
+import dataclasses
+import gzip
+import hashlib
+import multiprocessing
+import os
+import re
+import threading
+import typing
+
+import krcg.collections
+import orjson
+
+from . import cache, models, proposal
+
+MANIFEST = "manifest.json"
+#: Where the page of a uid is exported, by site page
+PAGE_FOLDERS = {b"index.html": b"cards", b"groups.html": b"groups"}
+RE_PAGE_LINK = re.compile(rb'href="([\w-]+\.html)(?:\?uid=([\w-]+))?"')
+
+#: A page source: the bytes the page is rendered from, and the rendering itself.
+Source = typing.Callable[[str, str], tuple[bytes, typing.Callable[[], bytes]]]
+
+
+@dataclasses.dataclass
+class Stats:
+    written: int = 0
+    unchanged: int = 0
+    removed: int = 0
+
+
+def static_links(html: bytes) -> bytes:
+    """Point the links to card and group pages at their exported file, and make the other page
+    links absolute: relative to `cards/` or `groups/`, they would miss."""
+
+    def replace(match: re.Match[bytes]) -> bytes:
+        page, uid = match.groups()
+        if uid is None:
+            return b'href="/%s"' % page
+        if page in PAGE_FOLDERS:
+            return b'href="/%s/%s.html"' % (PAGE_FOLDERS[page], uid)
+        return b'href="/%s?uid=%s"' % (page, uid)
+
+    return RE_PAGE_LINK.sub(replace, html)
+
+
+def digest(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def write(dest: str, path: str, body: bytes, compress: bool) -> None:
+    """Replace the file atomically (a server may be reading it), with its .gz sibling if asked."""
+    filename = os.path.join(dest, path)
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    outputs = [(filename, body)]
+    if compress:  # mtime=0: a rerun gives the same bytes
+        outputs.append((filename + ".gz", gzip.compress(body, compresslevel=9, mtime=0)))
+    for name, data in outputs:
+        with open(name + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(name + ".tmp", name)
+
+
+def remove(dest: str, path: str) -> None:
+    for name in (path, path + ".gz"):
+        try:
+            os.remove(os.path.join(dest, name))
+        except FileNotFoundError:
+            pass
+
+
+def corpus(manager: proposal.Manager) -> dict[str, typing.Any]:
+    """The whole index, resolved: rulings with their parsed cards, symbols and references by target
+    (cards rulings without the ones they get from their groups), groups with their members."""
+    base = manager.base
+    rulings = {}
+    for uid in sorted(base.rulings):
+        target_rulings = list(manager.get_rulings(uid, group=False))
+        if target_rulings:
+            rulings[uid] = target_rulings
+    return {
+        "version": base.version,
+        "committed_at": base.committed_at,
+        "references": sorted(manager.all_references(), key=lambda r: r.uid),
+        "groups": list(manager.all_groups()),
+        "rulings": rulings,
+    }
+
+
+def index_corpus(card_map: krcg.collections.CardDict, index: models.Index) -> dict[str, typing.Any]:
+    """The corpus of the index, built once per index."""
+    memo = index.memo("export")
+    if "corpus" not in memo:
+        memo["corpus"] = corpus(proposal.ReadOnlyManager(card_map, index))
+    return memo["corpus"]
+
+
+def corpus_entries(
+    card_map: krcg.collections.CardDict, index: models.Index
+) -> dict[str, cache.Entry]:
+    """The encoded corpus, plain and gzipped, built once per index."""
+    memo = index.memo("export")
+    if "identity" not in memo:
+        body = orjson.dumps(index_corpus(card_map, index))
+        compressed = gzip.compress(body, compresslevel=9, mtime=0)
+        memo["identity"] = cache.Entry(body, cache.etag(body))
+        memo["gzip"] = cache.Entry(compressed, cache.etag(compressed))
+    return {"identity": memo["identity"], "gzip": memo["gzip"]}
+
+
+# Worker state, set before the pool forks: the workers inherit the loaded index with it.
+_JOB: dict[str, typing.Any] = {}
+
+
+def _export_page(target: tuple[str, str, str]) -> tuple[str, str, bool]:
+    """Render and write one page, unless its source did not change since the last export."""
+    path, page, uid = target
+    source, render = _JOB["source"](page, uid)
+    key = digest(source)
+    filename = os.path.join(_JOB["dest"], path)
+    if (
+        _JOB["previous"].get(path) == key
+        and os.path.exists(filename)
+        and (not _JOB["compress"] or os.path.exists(filename + ".gz"))
+    ):
+        return path, key, False
+    write(_JOB["dest"], path, render(), _JOB["compress"])
+    return path, key, True
+
+
+def export(
+    dest: str,
+    targets: typing.Iterable[tuple[str, str, str]],
+    source: Source,
+    files: dict[str, bytes],
+    jobs: int = 0,
+    compress: bool = False,
+) -> Stats:
+    """Export the (path, page, uid) targets rendered by the source, and the given plain files.
+
+    Pages render in a pool of `jobs` forked processes (all CPUs by default, inline for 1): no
+    other thread may be running then, the workers would inherit the locks it holds.
+    """
+    if jobs != 1 and threading.active_count() > 1:
+        raise RuntimeError("Cannot fork the export workers: threads are running")
+    os.makedirs(dest, exist_ok=True)
+    try:
+        with open(os.path.join(dest, MANIFEST), "rb") as f:
+            previous = orjson.loads(f.read())
+    except (FileNotFoundError, orjson.JSONDecodeError):
+        previous = {}
+    _JOB.update(source=source, dest=dest, previous=previous, compress=compress)
+    targets = list(targets)
+    try:
+        if jobs == 1:
+            results = [_export_page(target) for target in targets]
+        else:
+            # fork, not the platform default: workers must inherit the index and templates
+            context = multiprocessing.get_context("fork")
+            with context.Pool(jobs or None) as pool:
+                results = pool.map(_export_page, targets, chunksize=64)
+    finally:
+        _JOB.clear()
+    stats = Stats()
+    manifest = {}
+    for path, key, written in results:
+        manifest[path] = key
+        if written:
+            stats.written += 1
+        else:
+            stats.unchanged += 1
+    for path, body in files.items():
+        key = digest(body)
+        manifest[path] = key
+        if previous.get(path) == key and os.path.exists(os.path.join(dest, path)):
+            stats.unchanged += 1
+            continue
+        write(dest, path, body, compress)
+        stats.written += 1
+    for path in previous.keys() - manifest.keys():
+        remove(dest, path)
+        stats.removed += 1
+    write(dest, MANIFEST, orjson.dumps(manifest, option=orjson.OPT_SORT_KEYS), False)
+    return stats
@@ -0,0 +1,42 @@
+"""Liveness and readiness of a worker, for load balancers and systemd (/healthz, /readyz).
+
+The worker starts up in the background, phase by phase, a failed phase retried: meanwhile it
+answers what does not need the rulings (static files, the 404 page, these checks). It is ready
+once the first index is loaded: later rebuilds (approvals, other nodes) keep the previous index
+live until the swap, so they never flip readiness back.
+"""
+
+import time
+
+import starlette.datastructures
+
+#: Startup phases, in order
+PHASES = ("cards", "database", "repository", "index")
+
+
+class Health:
+    def __init__(self):
+        self.started = time.time()
+        self.phases: dict[str, float] = {}  # phase: seconds since the start when it was done
+        self.error = ""  # of the last failed attempt, until the phase is done
+
+    def __contains__(self, phase: str) -> bool:
+        return phase in self.phases
+
+    def done(self, phase: str) -> None:
+        self.phases[phase] = round(time.time() - self.started, 3)
+        self.error = ""
+
+    @property
+    def ready(self) -> bool:
+        return all(phase in self.phases for phase in PHASES)
+
+    def report(self, state: starlette.datastructures.State) -> dict:
+        holder = getattr(state, "index_holder", None)
+        return {
+            "ready": self.ready,
+            "phases": {phase: self.phases.get(phase) for phase in PHASES},
+            "error": self.error,
+            "generation": holder.current.number if holder else None,
+            "uptime": round(time.time() - self.started, 3),
+        }
@@ -1,5 +1,7 @@
 import dataclasses
 import enum
+import hashlib
+import typing
 
 import pydantic.dataclasses
 
@@ -89,6 +91,21 @@ class Group:
     state: State
     cards: list[CardInGroup] = dataclasses.field(default_factory=list)
 
+    def __post_init__(self):
+        self.reindex()
+
+    def reindex(self) -> None:
+        """Rebuild the card uid -> member map. `cards` is the source of truth (and what gets
+        serialized), so whoever rewrites it calls this afterwards."""
+        self._members: dict[str, CardInGroup] = {}
+        for card in self.cards:
+            self._members.setdefault(card.uid, card)
+
+    def member(self, card_uid: str) -> CardInGroup | None:
+        """The card's entry in the group, whatever its state (a proposal keeps removed members
+        listed as DELETED). None if the card is not listed."""
+        return self._members.get(card_uid)
+
 
 @pydantic.dataclasses.dataclass
 class GroupOfCard(NID):
@@ -150,6 +167,76 @@ class LibraryCard(Card):
     conviction_cost: str = ""
 
 
+#: What an index keeps content hashes of, by uid (rulings by target)
+HASHED_KINDS = ("rulings", "groups", "references")
+
+
+def content_hash(data: str) -> bytes:
+    return hashlib.blake2b(data.encode(), digest_size=16).digest()
+
+
+def _rulings_hash(rulings: dict[str, Ruling]) -> bytes:
+    """Sorted by uid: the order the rulings were loaded or edited in is not content."""
+    return content_hash(
+        repr(
+            [
+                (r.uid, r.kind.value, r.text, sorted(r.overrides.items()))
+                for _, r in sorted(rulings.items())
+            ]
+        )
+    )
+
+
+def _group_hash(group: Group) -> bytes:
+    return content_hash(repr((group.name, [(card.uid, card.prefix) for card in group.cards])))
+
+
+def _reference_hash(reference: Reference) -> bytes:
+    return content_hash(reference.url)
+
+
+_HASHERS: dict[str, typing.Callable[[typing.Any], bytes]] = {
+    "rulings": _rulings_hash,
+    "groups": _group_hash,
+    "references": _reference_hash,
+}
+
+
+@pydantic.dataclasses.dataclass(
+    config=pydantic.ConfigDict(ser_json_bytes="base64", val_json_bytes="base64")
+)
+class ContentHashes:
+    """Merkle-style content hashes of an index: one per rulings target, group and reference, of
+    what is persisted (states aside), rolled up per kind then into the root."""
+
+    items: dict[str, dict[str, bytes]] = dataclasses.field(
+        default_factory=lambda: {kind: {} for kind in HASHED_KINDS}
+    )
+    kinds: dict[str, bytes] = dataclasses.field(default_factory=dict)
+    root: bytes = b""
+
+    def rollup(self, kinds: typing.Iterable[str] = HASHED_KINDS) -> None:
+        for kind in kinds:
+            self.kinds[kind] = content_hash(repr(sorted(self.items[kind].items())))
+        self.root = content_hash(repr([self.kinds.get(kind) for kind in HASHED_KINDS]))
+
+    def diff(self, old: "ContentHashes") -> dict[str, dict[str, list[str]]]:
+        """The uids added, modified and deleted since the old hashes, by kind. Only the kinds
+        whose roll-up differs are walked."""
+        ret = {}
+        for kind in HASHED_KINDS:
+            ret[kind] = {"added": [], "modified": [], "deleted": []}
+            if self.root == old.root or self.kinds.get(kind) == old.kinds.get(kind):
+                continue
+            before, after = old.items[kind], self.items[kind]
+            ret[kind]["added"] = sorted(after.keys() - before.keys())
+            ret[kind]["modified"] = sorted(
+                uid for uid in after.keys() & before.keys() if after[uid] != before[uid]
+            )
+            ret[kind]["deleted"] = sorted(before.keys() - after.keys())
+        return ret
+
+
 @pydantic.dataclasses.dataclass
 class BaseIndex:
     references: dict[str, Reference] = dataclasses.field(default_factory=dict)
@@ -165,9 +252,57 @@ class Backref:
 
 @pydantic.dataclasses.dataclass
 class Index(BaseIndex):
+    #: the rulings repository commit it was loaded from, empty for an uncommitted working tree
+    version: str = ""
+    #: that commit timestamp
+    committed_at: int = 0
     # convenience indexes generated from the previous ones on load
     groups_of_card: dict[str, set[str]] = dataclasses.field(default_factory=dict)
     backrefs: dict[str, list[Backref]] = dataclasses.field(default_factory=dict)
+    references_by_url: dict[str, str] = dataclasses.field(default_factory=dict)
+    #: reference uid -> the rulings citing it, as backrefs are for the cards a ruling mentions
+    citations: dict[str, list[Backref]] = dataclasses.field(default_factory=dict)
+    #: card uid -> the rulings it gets from its groups, as the card effectively sees them
+    group_rulings: dict[str, list[Ruling]] = dataclasses.field(default_factory=dict)
+    #: content hashes of the references, groups and rulings, see rehash()
+    hashes: ContentHashes = dataclasses.field(default_factory=ContentHashes)
+
+    def __post_init__(self):
+        self._memo: dict[str, dict] = {}
+
+    @property
+    def content_version(self) -> str:
+        """The root content hash: two indexes with the same rulings have the same one."""
+        return self.hashes.root.hex()
+
+    def rehash(self, touched: dict[str, typing.Iterable[str]] | None = None) -> None:
+        """Hash the touched uids by kind (everything by default), then roll the hashes up: a load
+        hashes the whole index, a merge only what the proposal touched."""
+        sources = {"rulings": self.rulings, "groups": self.groups, "references": self.references}
+        kinds = [kind for kind in HASHED_KINDS if touched is None or kind in touched]
+        for kind in kinds:
+            items, hashes = sources[kind], self.hashes.items[kind]
+            for uid in list(items) if touched is None else touched[kind]:
+                if items.get(uid):  # a target without rulings is no target
+                    hashes[uid] = _HASHERS[kind](items[uid])
+                else:
+                    hashes.pop(uid, None)
+        self.hashes.rollup(kinds)
+
+    def memo(self, view: str) -> dict:
+        """A memo table for one view derived from this index (materialized backrefs…). Once
+        loaded an index is replaced, never mutated — approval loads a fresh one — so entries
+        cannot go stale, and they go away with the index they were computed from."""
+        return self._memo.setdefault(view, {})
+
+    def __getstate__(self):
+        # memo tables are neither deep-copied (merge copies the base to build the next index,
+        # which must start with empty ones) nor pickled
+        return {k: v for k, v in self.__dict__.items() if k != "_memo"}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._memo = {}
 
 
 @pydantic.dataclasses.dataclass
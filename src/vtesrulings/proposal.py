@@ -16,12 +16,37 @@ class Proposal(models.BaseIndex):
     name: str = ""
     description: str = ""
     channel_id: str = ""
+    #: bumped on every update changing its rulings, groups or references, for the caches of
+    #: what the proposal renders
+    version: int = 0
 
 
 def get_proposal_url(prop: Proposal):
     return f"/proposal.html?prop={prop.uid}"
 
 
+def _missing_reference(ruling: models.Ruling) -> models.ConsistencyError:
+    return models.ConsistencyError(ruling.target, ruling.uid, "At least one reference is required")
+
+
+def _name_taken(group: models.Group) -> models.ConsistencyError:
+    return models.ConsistencyError(
+        models.NID(group.uid, group.name), "", "Group name is already taken"
+    )
+
+
+def _group_errors(
+    group: models.Group, has_rulings: bool
+) -> typing.Generator[models.ConsistencyError]:
+    nid = models.NID(group.uid, group.name or "<unnamed>")
+    if not group.name:
+        yield models.ConsistencyError(nid, "", "Group has no name")
+    if not group.cards:
+        yield models.ConsistencyError(nid, "", "Group is empty")
+    if not has_rulings:
+        yield models.ConsistencyError(nid, "", "Group has no ruling")
+
+
 class Manager:
     def __init__(
         self,
@@ -37,6 +62,26 @@ class Manager:
         # Manager instance for the process lifetime (B019).
         self._base_card_cache: dict[int | str, models.BaseCard] = {}
         self._card_cache: dict[int | str, models.CryptCard | models.LibraryCard] = {}
+        # overlay indexes, built from the proposal on first use and dropped by _invalidate()
+        self._prop_backrefs: dict[str, list[models.Backref]] | None = None
+        self._prop_citations: dict[str, list[models.Backref]] | None = None
+
+    def _invalidate(self) -> None:
+        """Drop the overlay indexes: every method editing `self.prop.rulings` calls this."""
+        self._prop_backrefs = None
+        self._prop_citations = None
+
+    def _build_overlay(self) -> None:
+        self._prop_backrefs, self._prop_citations = {}, {}
+        for target_uid, rulings in self.prop.rulings.items():
+            for ruling_uid, ruling in rulings.items():
+                if ruling.state == models.State.DELETED:
+                    continue
+                backref = models.Backref(target_uid, ruling_uid)
+                for uid in {c.uid for c in ruling.cards}:
+                    self._prop_backrefs.setdefault(uid, []).append(backref)
+                for uid in {r.uid for r in ruling.references}:
+                    self._prop_citations.setdefault(uid, []).append(backref)
 
     def all_references(self, deleted: bool = False) -> typing.Generator[models.Reference]:
         for reference in self.prop.references.values():
@@ -59,23 +104,20 @@ class Manager:
         raise KeyError()
 
     def get_reference_by_url(self, url: str = "", deleted: bool = False) -> models.Reference:
+        """Return the Reference listed with this URL. Raise KeyError otherwise."""
         if url:
-            rev_proposal = {
-                ref.url: ref
-                for ref in self.prop.references.values()
-                if deleted or ref.state != models.State.DELETED
-            }
-            if url in rev_proposal:
-                return rev_proposal[url]
-            remove = {
-                uid
-                for uid, ref in self.prop.references.items()
-                if not deleted and ref.state == models.State.DELETED
-            }
-            rev_base = {
-                ref.url: ref for ref in self.base.references.values() if ref.uid not in remove
-            }
-            return rev_base[url]
+            found = None
+            for ref in self.prop.references.values():  # a handful: a scan is the cheap delta
+                if ref.url == url and (deleted or ref.state != models.State.DELETED):
+                    found = ref
+            if found:
+                return found
+            uid = self.base.references_by_url[url]
+            if not deleted and self.prop.references.get(uid, self.base.references[uid]).state == (
+                models.State.DELETED
+            ):
+                raise KeyError(f"Deleted reference {uid}")
+            return self.base.references[uid]
         raise KeyError()
 
     def all_groups(self, deleted: bool = False) -> typing.Generator[models.Group]:
@@ -129,45 +171,36 @@ class Manager:
             yield ruling
         if uid.startswith(("G", "P")) or not group:
             return
+        if self._groups_untouched(uid):
+            # materialized by load_base(): the same list for every request until the next approval
+            yield from self.base.group_rulings.get(uid, [])
+            return
         for grp, card_in_group in self.get_groups_of(uid):
             for ruling in self.get_rulings(grp.uid, True, False):
                 yield self._effective_group_ruling(uid, ruling, card_in_group)
 
     def _card_in_group(self, card_uid: str, group_uid: str) -> models.CardInGroup | None:
-        for group, card_in_group in self.get_groups_of(card_uid):
-            if group.uid == group_uid:
-                return card_in_group
-        return None
+        try:
+            return self.get_group(group_uid).member(card_uid)
+        except KeyError:
+            # group does not exist (removed by proposal)
+            return None
 
     def _effective_group_ruling(
         self, card_uid: str, ruling: models.Ruling, card_in_group: models.CardInGroup | None = None
     ) -> models.Ruling:
-        """The ruling a card effectively sees for one of its groups' rulings: the per-card text
-        override when present (references still shared from the base ruling), else prefix + base
-        text. An override subsumes the prefix for that one ruling. See pst #27."""
-        override = ruling.overrides.get(card_uid)
-        if override is not None:
-            text = override
-            symbols = list(utils.parse_symbols(override))
-            cards = list(utils.parse_cards(self.card_map, override))
-        else:
-            if card_in_group is None:
-                card_in_group = self._card_in_group(card_uid, ruling.target.uid)
-            prefix = card_in_group.prefix if card_in_group else ""
-            text = prefix + (" " if prefix else "") + ruling.text
-            symbols = ruling.symbols + (card_in_group.symbols if card_in_group else [])
-            cards = ruling.cards
-        return models.Ruling(
-            uid=ruling.uid,
-            target=ruling.target,
-            text=text,
-            state=ruling.state,
-            kind=ruling.kind,
-            symbols=symbols,
-            references=ruling.references,
-            cards=cards,
-            overrides=ruling.overrides,
-        )
+        if card_in_group is None and card_uid not in ruling.overrides:
+            card_in_group = self._card_in_group(card_uid, ruling.target.uid)
+        return utils.effective_group_ruling(self.card_map, card_uid, ruling, card_in_group)
+
+    def _groups_untouched(self, card_uid: str) -> bool:
+        """Whether the proposal leaves the card's groups and their rulings as they are in base."""
+        if any(
+            uid in self.prop.groups or uid in self.prop.rulings
+            for uid in self.base.groups_of_card.get(card_uid, ())
+        ):
+            return False
+        return not any(group.member(card_uid) for group in self.prop.groups.values())
 
     def get_ruling(self, target_uid: str, ruling_uid: str, deleted: bool = False) -> models.Ruling:
         """Retrieve a ruling by its target (card or group) and its uid.
@@ -202,22 +235,19 @@ class Manager:
         for uid in sorted(base):
             try:
                 group = self.get_group(uid)
-                match = [c for c in group.cards if c.uid == card_uid]
-                if match:
-                    yield group, match[0]
             except KeyError:
                 # group does not exist (removed by proposal)
                 continue
-            except IndexError:
-                # card not in group (removed by proposal)
-                continue
+            card = group.member(card_uid)
+            if card:
+                yield group, card
         for uid, group in self.prop.groups.items():
             if uid in base or group.state == models.State.DELETED:
                 # already done in previous loop
                 continue
-            match = [c for c in group.cards if c.uid == card_uid]
-            if match:
-                yield group, match[0]
+            card = group.member(card_uid)
+            if card:
+                yield group, card
 
     def get_groups_of_card(self, card_uid: str) -> typing.Generator[models.GroupOfCard]:
         """Yield the groups the card is a part of, as GroupOfCard objects.
@@ -232,30 +262,69 @@ class Manager:
                 symbols=card.symbols,
             )
 
+    def prop_backrefs(self) -> dict[str, list[models.Backref]]:
+        """The proposal's side of `base.backrefs`: card uid -> its live rulings mentioning it."""
+        if self._prop_backrefs is None:
+            self._build_overlay()
+        assert self._prop_backrefs is not None
+        return self._prop_backrefs
+
+    def prop_citations(self) -> dict[str, list[models.Backref]]:
+        """The proposal's side of `base.citations`: reference uid -> its live rulings citing it."""
+        if self._prop_citations is None:
+            self._build_overlay()
+        assert self._prop_citations is not None
+        return self._prop_citations
+
+    def get_citations(self, reference_uid: str) -> typing.Generator[models.Ruling]:
+        """Yield the rulings citing the given reference."""
+        for backref in self.base.citations.get(reference_uid, []):
+            if backref.ruling_uid in self.prop.rulings.get(backref.target_uid, {}):
+                continue  # ruling changed by proposal, take the proposal citations
+            yield self.base.rulings[backref.target_uid][backref.ruling_uid]
+        for backref in self.prop_citations().get(reference_uid, []):
+            try:
+                yield self.get_ruling(backref.target_uid, backref.ruling_uid)
+            except KeyError:
+                continue  # a NEW ruling whose base vanished under us (see get_ruling)
+
     def get_backrefs(self, card_uid: str) -> typing.Generator[models.BaseCard]:
         """Yield the cards that have a ruling mentioning the given card."""
-        backrefs = []
-        for target_uid, rulings in self.prop.rulings.items():
-            for ruling_uid, ruling in rulings.items():
-                if card_uid not in {c.uid for c in ruling.cards}:
-                    continue
-                if ruling.state == models.State.DELETED:
-                    continue
-                backrefs.append(models.Backref(target_uid, ruling_uid))
-        for backref in self.base.backrefs.get(card_uid, []):
-            if backref.ruling_uid in self.prop.rulings.get(backref.target_uid, {}):
-                # ruling changed by proposal, take the proposal backrefs
-                continue
-            backrefs.append(backref)
+        base = self.base.backrefs.get(card_uid, [])
+        # a base ruling changed by the proposal counts through the proposal backrefs
+        kept = [b for b in base if b.ruling_uid not in self.prop.rulings.get(b.target_uid, {})]
+        added = self.prop_backrefs().get(card_uid, [])
+        targets = {b.target_uid for b in kept} | {b.target_uid for b in added}
+        if len(kept) == len(base) and not added and targets.isdisjoint(self.prop.groups):
+            # untouched by the proposal: the base index answer, materialized once per index
+            memo = self.base.memo("backrefs")
+            if card_uid not in memo:
+                memo[card_uid] = list(self._backref_cards(targets, self.base.groups.get))
+            yield from memo[card_uid]
+            return
+        yield from self._backref_cards(targets, self._get_live_group)
+
+    def _get_live_group(self, uid: str) -> models.Group | None:
+        try:
+            return self.get_group(uid)
+        except KeyError:
+            return None  # group does not exist (removed by proposal)
+
+    def _backref_cards(
+        self,
+        targets: set[str],
+        get_group: typing.Callable[[str], models.Group | None],
+    ) -> typing.Generator[models.BaseCard]:
+        """The cards behind backref targets: a group stands for its members."""
         seen: set[str] = set()  # a card reachable via two groups (or a group + direct ruling) once
-        for uid in sorted({b.target_uid for b in backrefs}):
+        for uid in sorted(targets):
             if uid.startswith(("G", "P")):
-                try:
-                    members = self.get_group(uid).cards
-                except KeyError:
-                    continue  # group does not exist (removed by proposal)
+                group = get_group(uid)
+                if group is None:
+                    continue
+                members: list[models.CardInGroup] | list[models.BaseCard] = group.cards
             else:
-                members = [utils.build_base_card(self.card_map, int(uid))]
+                members = [self.get_base_card(int(uid))]
             for card in members:
                 if card.uid in seen:
                     continue
@@ -390,6 +459,7 @@ class Manager:
             raise ValueError("An identical ruling exists already")
         self.prop.rulings.setdefault(target_uid, {})
         self.prop.rulings[target_uid][ruling.uid] = ruling
+        self._invalidate()
         return ruling
 
     @staticmethod
@@ -419,6 +489,7 @@ class Manager:
         old_ruling = self.get_ruling(target_uid, uid)
         ruling.overrides = dict(old_ruling.overrides)  # a text edit keeps any per-card overrides
         self.prop.rulings.setdefault(target_uid, {})
+        self._invalidate()
         if old_ruling.state == models.State.NEW:
             ruling.state = models.State.NEW
             self.prop.rulings[target_uid].pop(uid, None)
@@ -444,6 +515,7 @@ class Manager:
         if text and not self._card_in_group(card_uid, target_uid):
             raise ValueError(f"Card {card_uid} is not a member of group {target_uid}")
         prop = self.prop.rulings.setdefault(target_uid, {})
+        self._invalidate()
         if uid in prop:
             ruling = prop[uid]
             if ruling.state == models.State.DELETED:
@@ -468,12 +540,14 @@ class Manager:
     def restore_ruling(self, target_uid: str, uid: str) -> models.Ruling:
         """Restore the given ruling"""
         self.prop.rulings[target_uid].pop(uid, None)
+        self._invalidate()
         if not self.prop.rulings[target_uid]:
             del self.prop.rulings[target_uid]
         return self.base.rulings[target_uid][uid]
 
     def delete_ruling(self, target_uid: str, uid: str) -> models.Ruling | None:
         """Delete the given ruling. Yield KeyError if not found."""
+        self._invalidate()
         if uid in self.prop.rulings.get(target_uid, {}) and uid not in self.base.rulings.get(
             target_uid, {}
         ):
@@ -563,6 +637,7 @@ class Manager:
                     )
                 ),
             )
+        group.reindex()
         if group.state == models.State.ORIGINAL:
             # edited back to the base group: drop the overlay entirely
             self.prop.groups.pop(uid, None)
@@ -576,16 +651,14 @@ class Manager:
             raise KeyError(f"Unmodified group {uid}")
         group = self.prop.groups[uid]
         prop_cards = {c.uid: c for c in group.cards}
-        if uid in self.base.groups:
-            base_cards = {c.uid: c for c in self.base.groups[uid].cards}
-        else:
-            base_cards = {}
-        card = base_cards.get(card_uid, None)
+        base = self.base.groups.get(uid)
+        card = base.member(card_uid) if base else None
         if card:
             prop_cards[card_uid] = card
         else:
             prop_cards.pop(card_uid, None)
         group.cards = list(prop_cards.values())
+        group.reindex()
         return group
 
     def restore_group(self, uid: str) -> models.Group:
@@ -600,6 +673,7 @@ class Manager:
             del self.prop.groups[uid]
             if uid in self.prop.rulings:
                 del self.prop.rulings[uid]
+                self._invalidate()
         else:
             self.prop.groups[uid] = copy.deepcopy(self.base.groups[uid])
             self.prop.groups[uid].state = models.State.DELETED
@@ -676,6 +750,17 @@ class Manager:
         Returns the inconsistencies found.
         Remove unused references if there's none.
         """
+        errors, unused_references = self._check_touched()
+        if not errors:
+            for ref in unused_references:
+                if ref.startswith("RBK"):
+                    continue
+                self.delete_reference(ref)
+        return errors
+
+    def _check_all(self) -> tuple[list[models.ConsistencyError], set[str]]:
+        """The consistency errors and unused references, validating the whole corpus.
+        Kept as the reference implementation for _check_touched()."""
         errors = []
         listed_refs = {r.uid for r in self.all_references()}
         used_references = set()
@@ -683,52 +768,122 @@ class Manager:
             ruling_refs = {r.uid for r in ruling.references}
             ruling_refs &= listed_refs
             if not ruling_refs and ruling.kind != models.RulingKind.REMINDER:
-                errors.append(
-                    models.ConsistencyError(
-                        ruling.target, ruling.uid, "At least one reference is required"
-                    )
-                )
+                errors.append(_missing_reference(ruling))
             used_references |= ruling_refs
         group_names = set()
         for group in self.all_groups():
-            if not group.name:
-                errors.append(
-                    models.ConsistencyError(
-                        models.NID(group.uid, "<unnamed>"), "", "Group has no name"
-                    )
-                )
-            elif group.name in group_names:
-                errors.append(
-                    models.ConsistencyError(
-                        models.NID(group.uid, group.name),
-                        "",
-                        "Group name is already taken",
-                    )
-                )
+            errors.extend(_group_errors(group, any(True for _ in self.get_rulings(group.uid))))
+            if group.name and group.name in group_names:
+                errors.append(_name_taken(group))
             group_names.add(group.name)
-            if not group.cards:
-                errors.append(
-                    models.ConsistencyError(
-                        models.NID(group.uid, group.name or "<unnamed>"),
-                        "",
-                        "Group is empty",
-                    )
-                )
-            if not list(self.get_rulings(group.uid)):
-                errors.append(
-                    models.ConsistencyError(
-                        models.NID(group.uid, group.name or "<unnamed>"),
-                        "",
-                        "Group has no ruling",
-                    )
-                )
-        if not errors:
-            unused_references = listed_refs - used_references
-            for ref in unused_references:
-                if ref.startswith("RBK"):
-                    continue
-                self.delete_reference(ref)
-        return errors
+        return errors, listed_refs - used_references
+
+    def _check_touched(self) -> tuple[list[models.ConsistencyError], set[str]]:
+        """Same result as _check_all(), but only the targets, groups and references the proposal
+        touched are validated: everything else is answered by the base invariants."""
+        invariants = self._base_invariants()
+        errors = []
+
+        def listed(uid: str) -> bool:
+            if uid in self.prop.references:
+                return self.prop.references[uid].state != models.State.DELETED
+            return uid in self.base.references
+
+        # rulings: the proposal ones, base ones citing a reference the proposal (un)lists,
+        # and the base errors that a new reference could fix
+        checked: set[tuple[str, str]] = set()
+        to_check: list[models.Ruling] = []
+        for target_uid, rulings in self.prop.rulings.items():
+            to_check.extend(r for r in self.get_rulings(target_uid, False) if r.uid in rulings)
+        backrefs = [b for ref in self.prop.references for b in self.base.citations.get(ref, [])]
+        backrefs.extend(invariants["ruling_errors"])
+        for backref in backrefs:
+            if backref.ruling_uid in self.prop.rulings.get(backref.target_uid, {}):
+                continue  # already in the proposal rulings
+            to_check.append(self.base.rulings[backref.target_uid][backref.ruling_uid])
+        for ruling in to_check:
+            if (ruling.target.uid, ruling.uid) in checked:
+                continue
+            checked.add((ruling.target.uid, ruling.uid))
+            if ruling.kind == models.RulingKind.REMINDER:
+                continue
+            if not any(listed(r.uid) for r in ruling.references):
+                errors.append(_missing_reference(ruling))
+        # groups: the proposal ones, and the base ones whose rulings the proposal changed
+        touched = set(self.prop.groups) | {
+            uid for uid in self.prop.rulings if uid.startswith(("G", "P"))
+        }
+        for uid in touched:
+            try:
+                group = self.get_group(uid)
+            except KeyError:
+                continue  # group removed by the proposal
+            errors.extend(_group_errors(group, any(True for _ in self.get_rulings(uid))))
+        for uid, group_errors in invariants["group_errors"].items():
+            if uid not in touched:
+                errors.extend(group_errors)
+        names = {g.name for g in self.prop.groups.values()}
+        names |= {self.base.groups[uid].name for uid in self.prop.groups if uid in self.base.groups}
+        for name, uids in invariants["group_names"].items():
+            if len(uids) > 1 and name not in names:
+                errors.extend(_name_taken(self.base.groups[uid]) for uid in uids[1:])
+        # same order as all_groups(): the first group listed keeps the name
+        prop_groups = sorted(
+            (g for g in self.prop.groups.values() if g.state != models.State.DELETED),
+            key=lambda g: g.name,
+        )
+        for name in names:
+            if not name:
+                continue
+            same_name = [g for g in prop_groups if g.name == name]
+            same_name.extend(
+                self.base.groups[uid]
+                for uid in invariants["group_names"].get(name, [])
+                if uid not in self.prop.groups
+            )
+            errors.extend(_name_taken(group) for group in same_name[1:])
+        # references: only those the proposal lists or may have left without a citation
+        candidates = invariants["unused"] | set(self.prop.references)
+        lost: dict[str, int] = {}
+        for target_uid, rulings in self.prop.rulings.items():
+            for ruling_uid in rulings:
+                base = self.base.rulings.get(target_uid, {}).get(ruling_uid)
+                for ref in {r.uid for r in base.references} if base else ():
+                    lost[ref] = lost.get(ref, 0) + 1
+                    candidates.add(ref)
+        prop_citations = self.prop_citations()
+        unused_references = {
+            ref
+            for ref in candidates
+            if listed(ref)
+            and len(self.base.citations.get(ref, [])) <= lost.get(ref, 0)
+            and ref not in prop_citations
+        }
+        return errors, unused_references
+
+    def _base_invariants(self) -> dict:
+        """What the consistency check needs to know of the base index, computed once per index:
+        the rulings and groups in error, the groups by name and the unused references."""
+        ret = self.base.memo("consistency")
+        if ret:
+            return ret
+        ret["ruling_errors"] = [
+            models.Backref(target_uid, ruling.uid)
+            for target_uid, rulings in self.base.rulings.items()
+            for ruling in rulings.values()
+            if ruling.kind != models.RulingKind.REMINDER
+            and not any(r.uid in self.base.references for r in ruling.references)
+        ]
+        ret["group_errors"] = {}
+        ret["group_names"] = {}
+        for group in sorted(self.base.groups.values(), key=lambda g: g.name):
+            group_errors = list(_group_errors(group, bool(self.base.rulings.get(group.uid))))
+            if group_errors:
+                ret["group_errors"][group.uid] = group_errors
+            if group.name:
+                ret["group_names"].setdefault(group.name, []).append(group.uid)
+        ret["unused"] = {uid for uid in self.base.references if uid not in self.base.citations}
+        return ret
 
     def diff(self) -> models.ProposalDiff:
         """A structured view of everything the overlay changes, grouped by kind then target.
@@ -754,18 +909,18 @@ class Manager:
                 old_name=base.name if base and base.name != group.name else "",
             )
             if group.state != models.State.DELETED:
-                base_cards = {c.uid: c for c in base.cards} if base else {}
                 for card in group.cards:
                     if card.state == models.State.ORIGINAL:
                         continue
+                    base_card = base.member(card.uid) if base else None
                     gd.cards.append(
                         models.GroupCardChange(
                             uid=card.uid,
                             name=card.name,
                             state=card.state,
                             prefix=card.prefix,
-                            old_prefix=base_cards[card.uid].prefix
-                            if card.state == models.State.MODIFIED and card.uid in base_cards
+                            old_prefix=base_card.prefix
+                            if card.state == models.State.MODIFIED and base_card
                             else "",
                         )
                     )
@@ -840,6 +995,8 @@ class Manager:
                 ret.groups[key].cards.append(copy.deepcopy(card))
             if not ret.groups[key].cards:
                 del ret.groups[key]
+                continue
+            ret.groups[key].reindex()
         for target, rulings in self.prop.rulings.items():
             ret.rulings.setdefault(target, {})
             for key, value in rulings.items():
@@ -849,9 +1006,72 @@ class Manager:
                 ret.rulings[target][key] = copy.deepcopy(value)
             if not ret.rulings[target]:
                 del ret.rulings[target]
+        ret.rehash(
+            {
+                "references": self.prop.references.keys(),
+                "groups": self.prop.groups.keys(),
+                "rulings": self.prop.rulings.keys(),
+            }
+        )
         return ret
 
 
+class ReadOnlyManager(Manager):
+    """The base index alone, for requests without a proposal: no overlay to merge, answers come
+    straight from the index and the views it keeps presorted. Edits would land on a throwaway
+    proposal: use a Manager for those."""
+
+    def __init__(self, card_map: krcg.collections.CardDict, index: models.Index):
+        super().__init__(card_map, index)
+
+    def all_references(self, deleted: bool = False) -> typing.Generator[models.Reference]:
+        yield from self.base.references.values()
+
+    def get_reference(self, uid: str = "", deleted: bool = False) -> models.Reference:
+        if uid:
+            return self.base.references[uid]
+        raise KeyError()
+
+    def get_reference_by_url(self, url: str = "", deleted: bool = False) -> models.Reference:
+        return self.base.references[self.base.references_by_url[url]]
+
+    def all_groups(self, deleted: bool = False) -> typing.Generator[models.Group]:
+        views = self.base.memo("readonly")
+        if "groups" not in views:
+            views["groups"] = sorted(self.base.groups.values(), key=lambda g: g.name)
+        yield from views["groups"]
+
+    def get_group(self, uid: str, deleted: bool = False) -> models.Group:
+        return self.base.groups[uid]
+
+    def all_rulings(self, deleted: bool = False) -> typing.Generator[models.Ruling]:
+        for rulings in self.base.rulings.values():
+            yield from rulings.values()
+
+    def get_rulings(
+        self, uid: str, group: bool = True, deleted: bool = False
+    ) -> typing.Generator[models.Ruling]:
+        yield from self.base.rulings.get(uid, {}).values()
+        if group and not uid.startswith(("G", "P")):
+            yield from self.base.group_rulings.get(uid, [])
+
+    def get_ruling(self, target_uid: str, ruling_uid: str, deleted: bool = False) -> models.Ruling:
+        return self.base.rulings[target_uid][ruling_uid]
+
+    def get_groups_of(
+        self, card_uid: str
+    ) -> typing.Generator[tuple[models.Group, models.CardInGroup]]:
+        for uid in sorted(self.base.groups_of_card.get(card_uid, ())):
+            group = self.base.groups[uid]
+            card = group.member(card_uid)
+            if card:
+                yield group, card
+
+    def get_citations(self, reference_uid: str) -> typing.Generator[models.Ruling]:
+        for backref in self.base.citations.get(reference_uid, []):
+            yield self.base.rulings[backref.target_uid][backref.ruling_uid]
+
+
 class ModifiedDict(collections.abc.Mapping[str, models.Reference]):
     """Utility class used to provide a cheap no-copy dict overlay.
     Useful for building Ruling objects, since a references map is required."""
@@ -124,14 +124,27 @@ RULINGS_COMMENT = """# ## Design notes
 YAML_PARAMS = {"width": 120, "allow_unicode": True, "indent": 2}
 
 
-async def clone(repo_dir: str) -> git.Repo:
+def clone_sync(repo_dir: str) -> git.Repo:
     env = {"GIT_SSH_COMMAND": GIT_SSH_COMMAND} if GIT_SSH_COMMAND else None
-    ret = await asgiref.sync.SyncToAsync(git.Repo.clone_from)(
-        RULINGS_GIT,
-        repo_dir,
-        env=env,
-    )
-    return ret
+    return git.Repo.clone_from(RULINGS_GIT, repo_dir, env=env)
+
+
+async def clone(repo_dir: str) -> git.Repo:
+    return await asgiref.sync.SyncToAsync(clone_sync)(repo_dir)
+
+
+async def fetch(repo: git.Repo, sha: str = "") -> str:
+    """Fetch the remote and move the checkout to the given commit, the remote HEAD by default
+    (dropping a local commit whose push failed). Returns the commit sha checked out."""
+
+    def _fetch():
+        env = {"GIT_SSH_COMMAND": GIT_SSH_COMMAND} if GIT_SSH_COMMAND else {}
+        with repo.git.custom_environment(**env):
+            repo.git.fetch("origin")
+        repo.git.reset("--hard", sha or "origin/HEAD")
+        return repo.head.commit.hexsha
+
+    return await asgiref.sync.SyncToAsync(_fetch)()
 
 
 async def _installation_token(installation_id: str | None = GITHUB_INSTALLATION_ID) -> str | None:
@@ -265,6 +278,9 @@ async def async_yaml_load(f: aiofiles.threadpool.text.AsyncTextIOWrapper) -> typ
 
 async def load_base(repo: git.Repo, card_map: krcg.collections.CardDict) -> models.Index:
     ret = models.Index()
+    if repo.head.is_valid():
+        ret.version = repo.head.commit.hexsha
+        ret.committed_at = repo.head.commit.committed_date
     assert repo.working_tree_dir is not None  # never a bare repo
     rulings_dir = pathlib.Path(repo.working_tree_dir) / RULINGS_FILES_PATH
     # build references index
@@ -272,6 +288,7 @@ async def load_base(repo: git.Repo, card_map: krcg.collections.CardDict) -> mode
         yaml_references = await async_yaml_load(f)
     for uid, url in yaml_references.items():
         ret.references[uid] = utils.build_reference(uid, url, models.State.ORIGINAL)
+        ret.references_by_url[url] = uid
     # build groups index
     async with aiofiles.open(rulings_dir / "groups.yaml") as f:
         data = await async_yaml_load(f)
@@ -296,6 +313,7 @@ async def load_base(repo: git.Repo, card_map: krcg.collections.CardDict) -> mode
             )
             ret.groups_of_card.setdefault(card_ref.uid, set())
             ret.groups_of_card[card_ref.uid].add(nid.uid)
+        group.reindex()
         ret.groups[group.uid] = group
     # build rulings index
     async with aiofiles.open(rulings_dir / "rulings.yaml") as f:
@@ -333,6 +351,24 @@ async def load_base(repo: git.Repo, card_map: krcg.collections.CardDict) -> mode
             for card in ruling.cards:
                 ret.backrefs.setdefault(card.uid, [])
                 ret.backrefs[card.uid].append(models.Backref(nid.uid, ruling.uid))
+            for reference in ruling.references:
+                ret.citations.setdefault(reference.uid, [])
+                ret.citations[reference.uid].append(models.Backref(nid.uid, ruling.uid))
+    # materialize group rulings per card, in the order Manager.get_rulings() yields them
+    for card_uid, group_uids in ret.groups_of_card.items():
+        for group_uid in sorted(group_uids):
+            card_in_group = ret.groups[group_uid].member(card_uid)
+            if card_in_group is None:
+                continue  # groups_of_card is built from the members: never the case
+            for ruling in ret.rulings.get(group_uid, {}).values():
+                if card_uid not in ruling.overrides and not card_in_group.prefix:
+                    effective = ruling  # same text, symbols and cards: share the base object
+                else:
+                    effective = utils.effective_group_ruling(
+                        card_map, card_uid, ruling, card_in_group
+                    )
+                ret.group_rulings.setdefault(card_uid, []).append(effective)
+    ret.rehash()
     return ret
 
 
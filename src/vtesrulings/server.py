@@ -0,0 +1,289 @@
+"""Serving the app with forked workers (`rulings-web serve`), the index optionally preloaded,
+replacing the previous process without a gap.
+
+Preloaded, the master loads the cards and the rulings index once, then forks the workers: they
+share those pages copy-on-write instead of each loading its own. For the pages to stay shared, the
+master collects no garbage while loading (no freed holes in them) and freezes its heap before
+forking, so the workers' collections never write to those objects. Refcounts still move on what a
+request reads: the per-index memos and response caches (built in each worker) keep that to the
+first reads. An approval swaps a new index in each worker, built there: preloading pays off for
+deployments where the rulings are read-only between approvals.
+
+memory() tells what it saves: compare the workers' `private` memory with and without --preload.
+
+The listening socket is only bound once every worker is warmed up, with SO_REUSEPORT: on a
+deploy, the new process warms up while the previous one serves, then takes over (see run).
+"""
+
+import asyncio
+import errno
+import gc
+import logging
+import os
+import signal
+import socket
+import time
+import typing
+
+import hypercorn.asyncio
+import hypercorn.config
+
+logger = logging.getLogger()
+#: Seconds a worker has to finish its requests when stopped
+GRACEFUL_TIMEOUT = 5.0
+#: Pending connections queued by the kernel
+BACKLOG = 1024
+#: Seconds before replacing a worker that died (no busy loop if they die at startup)
+RESPAWN_DELAY = 1.0
+
+
+def memory(pid: int | str = "self") -> dict[str, int]:
+    """A process resident memory in bytes: rss, pss (each shared page split between the processes
+    sharing it), shared and private (pages of this process only). Empty off Linux."""
+    values = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                key, value, *_ = line.split()
+                if key.endswith(":"):
+                    values[key[:-1]] = int(value) * 1024
+    except (OSError, ValueError):
+        return {}
+    return {
+        "rss": values.get("Rss", 0),
+        "pss": values.get("Pss", 0),
+        "shared": values.get("Shared_Clean", 0) + values.get("Shared_Dirty", 0),
+        "private": values.get("Private_Clean", 0) + values.get("Private_Dirty", 0),
+    }
+
+
+def address(bind: str) -> tuple[socket.AddressFamily, tuple[str, int]]:
+    host, _, port = bind.rpartition(":")
+    host = host.strip("[]") or "127.0.0.1"
+    return (socket.AF_INET6 if ":" in host else socket.AF_INET), (host, int(port))
+
+
+def notify_systemd(message: str) -> None:
+    """sd_notify(3), when run by a systemd Type=notify unit."""
+    path = os.getenv("NOTIFY_SOCKET")
+    if not path:
+        return
+    if path.startswith("@"):
+        path = "\0" + path[1:]  # abstract namespace
+    with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+        sock.sendto(message.encode(), path)
+
+
+def read_pidfile(pidfile: str) -> int | None:
+    try:
+        with open(pidfile) as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+
+def replaced(pidfile: str) -> int | None:
+    """The process serving before this one, from its pidfile, if still running."""
+    pid = read_pidfile(pidfile)
+    if pid is None or pid == os.getpid():
+        return None
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return None
+    return pid
+
+
+def write_pidfile(pidfile: str) -> None:
+    with open(pidfile + ".tmp", "w") as f:
+        f.write(f"{os.getpid()}\n")
+    os.replace(pidfile + ".tmp", pidfile)
+
+
+# Set in the workers forked before serving: the pipes telling the master a worker is warmed up
+# (its pid written), and the master telling them to accept (its end closed).
+_PIPES: tuple[int, int] | None = None
+
+
+def warming() -> bool:
+    """Whether this worker must be warmed up before it accepts: the socket is not bound yet."""
+    return _PIPES is not None
+
+
+async def ready() -> None:
+    """Tell the master this worker is warmed up and wait until the socket is bound: the workers
+    start accepting together. A no-op for a worker replacing a dead one, or outside `serve`."""
+    global _PIPES
+    if _PIPES is None:
+        return
+    ready_w, go_r = _PIPES
+    _PIPES = None
+    os.write(ready_w, b"%d\n" % os.getpid())
+    os.close(ready_w)  # a worker dying must read as EOF, the others not waiting on it
+    loop = asyncio.get_running_loop()
+    go = loop.create_future()
+    loop.add_reader(go_r, lambda: go.done() or go.set_result(None))  # readable: EOF
+    try:
+        await go
+    finally:
+        loop.remove_reader(go_r)
+        os.close(go_r)
+
+
+async def _serve(app: typing.Any, config: hypercorn.config.Config) -> None:
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stop.set)
+    await hypercorn.asyncio.serve(app, config, shutdown_trigger=stop.wait)
+
+
+def _fork(
+    app: typing.Any, config: hypercorn.config.Config, pipes: tuple[int, int, int, int] | None
+) -> int:
+    """Fork a worker; pipes are (ready_r, ready_w, go_r, go_w) until the master serves."""
+    global _PIPES
+    pid = os.fork()
+    if pid:
+        return pid
+    code = 0
+    try:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        if pipes:
+            ready_r, ready_w, go_r, go_w = pipes
+            os.close(ready_r)
+            os.close(go_w)  # or the master closing its end would never read as EOF here
+            _PIPES = ready_w, go_r
+        gc.enable()
+        asyncio.run(_serve(app, config))
+    except BaseException:
+        logger.exception("worker %d failed", os.getpid())
+        code = 1
+    finally:
+        os._exit(code)
+
+
+def _take_over(
+    sock: socket.socket, addr: tuple[str, int], previous: int | None, pidfile: str
+) -> None:
+    """Bind and listen, alongside the previous process (SO_REUSEPORT), then stop it. This process
+    becomes the main one (pidfile, MAINPID) before the previous one is signalled: systemd must
+    never see the unit's main process exit, or it restarts the unit, standby included. A previous
+    process predating the standby mode (no SO_REUSEPORT) is stopped first, then its address taken
+    once released."""
+    try:
+        sock.bind(addr)
+        bound = True
+    except OSError as err:
+        if err.errno != errno.EADDRINUSE or not previous:
+            raise
+        bound = False
+    else:
+        sock.listen(BACKLOG)
+    if pidfile:
+        write_pidfile(pidfile)
+    notify_systemd(f"READY=1\nMAINPID={os.getpid()}")
+    if previous:
+        logger.warning("Stopping the previous process %d", previous)
+        try:
+            os.kill(previous, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    if bound:
+        return
+    logger.warning("%s:%d taken, waiting for the previous process %d", *addr, previous)
+    deadline = time.monotonic() + GRACEFUL_TIMEOUT + 5
+    while True:
+        time.sleep(0.2)
+        try:
+            sock.bind(addr)
+            break
+        except OSError as err:
+            if err.errno != errno.EADDRINUSE or time.monotonic() > deadline:
+                raise
+    sock.listen(BACKLOG)
+
+
+def run(
+    app: typing.Any,
+    bind: str,
+    workers: int,
+    preload: typing.Callable[[], None] | None = None,
+    pidfile: str = "",
+) -> None:
+    """Serve the app on bind (host:port) with forked workers, replaced if they die, until SIGTERM
+    or SIGINT. The preload callable, if any, runs in the master first: see the module docstring.
+    It must leave no thread running (a forked worker would miss it).
+
+    The socket is bound once every worker is warmed up (lifespan done, see ready), with
+    SO_REUSEPORT: the process of the pidfile, if running, keeps serving meanwhile. This process
+    takes the pidfile over and notifies systemd (READY=1, MAINPID) if run by a Type=notify unit,
+    then stops the previous one, draining its requests (see _take_over). A worker retries a failed startup phase (see
+    warm_up) with the previous process still serving; if a worker dies warming up, this process
+    exits and the previous one keeps serving.
+    """
+    previous = replaced(pidfile) if pidfile else None
+    if preload:
+        gc.disable()
+        preload()
+    family, addr = address(bind)
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    config = hypercorn.config.Config()
+    config.bind = [f"fd://{sock.fileno()}"]
+    config.graceful_timeout = GRACEFUL_TIMEOUT
+    if preload:
+        gc.freeze()
+        logger.warning("Preloaded: %s", memory())
+    stopping = False
+    children: set[int] = set()
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    ready_r, ready_w = os.pipe()
+    go_r, go_w = os.pipe()
+    for _ in range(workers):
+        children.add(_fork(app, config, (ready_r, ready_w, go_r, go_w)))
+    os.close(ready_w)
+    os.close(go_r)
+    warmed = set()
+    with os.fdopen(ready_r) as ready_lines:
+        for line in ready_lines:  # EOF: every worker either reported or died
+            warmed.add(int(line))
+            if warmed >= children:
+                break
+    if stopping or not warmed >= children:
+        stop(signal.SIGTERM, None)
+        os.close(go_w)
+        for pid in children:
+            os.waitpid(pid, 0)
+        sock.close()
+        raise SystemExit("workers failed to start" if not stopping else 0)
+    _take_over(sock, addr, previous, pidfile)
+    os.close(go_w)
+    logger.warning("Serving on %s with %d workers", bind, workers)
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        children.discard(pid)
+        if not stopping:
+            logger.warning("worker %d exited (%d)", pid, os.waitstatus_to_exitcode(status))
+            time.sleep(RESPAWN_DELAY)
+            if not stopping:
+                children.add(_fork(app, config, None))
+    sock.close()
+    if pidfile and read_pidfile(pidfile) == os.getpid():  # not taken over by a newer process
+        try:
+            os.remove(pidfile)
+        except FileNotFoundError:
+            pass
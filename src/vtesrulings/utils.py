@@ -1,12 +1,15 @@
 import base64
 import datetime
 import hashlib
+import heapq
 import random
 import re
 import typing
 import urllib.parse
 
 import krcg.collections
+import krcg.models
+import krcg.utils
 
 from . import models
 
@@ -174,6 +177,10 @@ RE_CRYPT_TRAIT = re.compile(
     r"|(?:[\w']+ ){1,2}(?:circle|slave))\.",
     re.IGNORECASE,
 )
+#: A decklist line: `3x Name`, `3 Name`, `Name x3` or a bare name, as the usual formats (Amaranth,
+#: VDB, Lackey, TWDA) write them. Crypt lines go on with columns (capacity, disciplines…).
+RE_DECK_LINE = re.compile(r"^(?:(\d+)\s*x?\s+)?(.+?)(?:\s+x\s*(\d+))?$", re.IGNORECASE)
+RE_DECK_COLUMNS = re.compile(r"\s{2,}|\t")
 
 
 def build_nid(label: str) -> models.NID:
@@ -305,6 +312,32 @@ def plain_text(text: str) -> str:
     return " ".join(text.split())
 
 
+def parse_decklist(
+    card_map: krcg.collections.CardDict, text: str
+) -> tuple[dict[int, int], list[str]]:
+    """The cards of a decklist by ID with their count, and the lines counting cards not found.
+    Lines neither counting nor naming a card (headers, comments) are skipped."""
+    cards: dict[int, int] = {}
+    unknown = []
+    for line in text.splitlines():
+        match = RE_DECK_LINE.match(line.strip())
+        if not match:
+            continue
+        count = int(match.group(1) or match.group(3) or 1)
+        name = match.group(2)
+        for candidate in (name, RE_DECK_COLUMNS.split(name, 1)[0]):
+            try:
+                card = card_map[candidate]
+            except KeyError:
+                continue
+            cards[card.id] = cards.get(card.id, 0) + count
+            break
+        else:
+            if match.group(1) or match.group(3):
+                unknown.append(line.strip())
+    return cards, unknown
+
+
 def stable_hash(s: str) -> str:
     """5 bytes hash gives a 8 chars b32 string
     Unlikely collisions bellow 100k items
@@ -337,6 +370,38 @@ def build_ruling(
     return ruling
 
 
+def effective_group_ruling(
+    card_map: krcg.collections.CardDict,
+    card_uid: str,
+    ruling: models.Ruling,
+    card_in_group: models.CardInGroup | None,
+) -> models.Ruling:
+    """The ruling a card effectively sees for one of its groups' rulings: the per-card text
+    override when present (references still shared from the base ruling), else prefix + base
+    text. An override subsumes the prefix for that one ruling. See pst #27."""
+    override = ruling.overrides.get(card_uid)
+    if override is not None:
+        text = override
+        symbols = list(parse_symbols(override))
+        cards = list(parse_cards(card_map, override))
+    else:
+        prefix = card_in_group.prefix if card_in_group else ""
+        text = prefix + (" " if prefix else "") + ruling.text
+        symbols = ruling.symbols + (card_in_group.symbols if card_in_group else [])
+        cards = ruling.cards
+    return models.Ruling(
+        uid=ruling.uid,
+        target=ruling.target,
+        text=text,
+        state=ruling.state,
+        kind=ruling.kind,
+        symbols=symbols,
+        references=ruling.references,
+        cards=cards,
+        overrides=ruling.overrides,
+    )
+
+
 def build_base_card(
     card_map: krcg.collections.CardDict, card_id_or_name: int | str
 ) -> models.BaseCard:
@@ -352,3 +417,41 @@ def build_base_card(
         printed_name=card.printed_name,
         img=card.url,
     )
+
+
+class CardCompletion:
+    """Card name autocompletion: krcg's complete() matching and ranking, without its per-keystroke
+    work.
+
+    krcg scores a card for each word prefix of its names (longer prefixes score more, the first
+    word double) and ranks the cards matching every query word, in any order, by their summed
+    score. The cards of a word prefix are ranked once, on first use: a one-word query (every
+    keystroke before the first space) is a slice of that ranking, and longer queries only sum the
+    scores of the cards the first word matched, the way krcg does.
+    """
+
+    def __init__(self, card_map: krcg.collections.CardDict):
+        self._scores = card_map.search_index.name[krcg.models.Lang.EN]
+        self._ranked: dict[str, list[krcg.models.Card]] = {}
+
+    def _ranking(self, part: str) -> list[krcg.models.Card]:
+        if part not in self._ranked:
+            scores = self._scores.get(part, {})
+            # stable: ties keep krcg's order, as Counter.most_common() does
+            self._ranked[part] = sorted(scores, key=scores.__getitem__, reverse=True)
+        return self._ranked[part]
+
+    def complete(self, text: str, limit: int = 10) -> list[krcg.models.Card]:
+        """The `limit` best cards whose names have words starting with each word of `text`."""
+        parts = krcg.utils.Trie._split(text)  # krcg's own normalization of the indexed names
+        if not parts:
+            return []
+        if len(parts) == 1:
+            return self._ranking(parts[0])[:limit]
+        scores = dict(self._scores.get(parts[0], {}))
+        for part in parts[1:]:
+            matches = self._scores.get(part, {})
+            scores = {
+                card: score + matches[card] for card, score in scores.items() if card in matches
+            }
+        return heapq.nlargest(limit, scores, key=scores.__getitem__)
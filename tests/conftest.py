@@ -1,6 +1,9 @@
+import asyncio
+import atexit
 import os
 import pathlib
 import shutil
+import tempfile
 
 # Force an isolated DB name *before* importing the app: the session fixture drops and
 # recreates this database, so it must never resolve to a developer's real `vtes-rulings`.
@@ -9,6 +12,10 @@ os.environ["DB_NAME"] = "vtes-rulings-test"
 # DATABASE_URL (the prod DSN var) would short-circuit DB_NAME in db.CONNINFO and route the
 # pool — incl. the truncating teardown — at a real DB while the -test guard still passes.
 os.environ.pop("DATABASE_URL", None)
+# Index snapshots in a throwaway directory too: one left in the developer's state directory by an
+# earlier run would be loaded instead of rebuilt, hiding load_base changes from the tests.
+os.environ["SNAPSHOT_DIR"] = tempfile.mkdtemp(prefix="vtes-rulings-snapshots-")
+atexit.register(shutil.rmtree, os.environ["SNAPSHOT_DIR"], ignore_errors=True)
 
 import asgi_lifespan
 import git
@@ -64,8 +71,13 @@ def _rulings_remote(tmp_path_factory):
 @pytest_asyncio.fixture(name="app", scope="session")
 async def _app(_test_database, rulings_remote):
     """Run the ASGI lifespan once per session (clones the fixture repo + loads cards — expensive)."""
-    async with asgi_lifespan.LifespanManager(vtesrulings.app, startup_timeout=120) as manager:
-        yield manager.app
+    app = vtesrulings.app
+    async with asgi_lifespan.LifespanManager(app, startup_timeout=120):
+        health = app.state.health
+        async with asyncio.timeout(120):  # the lifespan yields before loading: wait until ready
+            while not health.ready:
+                await asyncio.sleep(0.05)
+        yield app
 
 
 @pytest_asyncio.fixture(name="client")
@@ -1,3 +1,6 @@
+import asyncio
+import dataclasses
+import json
 import typing
 
 import krcg.collections
@@ -6,7 +9,7 @@ import pytest
 
 import vtesrulings
 import vtesrulings.discord
-from vtesrulings import models, repository, utils
+from vtesrulings import cache, db, events, export, health, models, proposal, repository, utils
 
 
 def test_serialize_ruling():
@@ -592,6 +595,68 @@ async def test_add_reference(client):
     }
 
 
+@pytest.mark.asyncio
+async def test_reference_rulings(client):
+    response = await client.get("/api/reference/LSJ 20040518/rulings")
+    assert response.status_code == 200
+    assert sorted(r["target"]["uid"] for r in response.json()) == [
+        "100038",
+        "100543",
+        "100543",
+        "100728",
+    ]
+    response = await client.get("/api/reference/LSJ 20991231/rulings")
+    assert response.status_code == 404
+    # rulings added in the proposal cite their references too
+    await login_and_proposal(client)
+    response = await client.post("/api/ruling/100015", json={"text": "Test ruling [LSJ 20040518]"})
+    assert response.status_code == 200
+    response = await client.get("/api/reference/LSJ 20040518/rulings")
+    assert response.status_code == 200
+    assert sorted(r["target"]["uid"] for r in response.json()) == [
+        "100015",
+        "100038",
+        "100543",
+        "100543",
+        "100728",
+    ]
+    response = await client.post(
+        "/api/reference/search",
+        json={
+            "url": (
+                "https://groups.google.com/g/rec.games.trading-cards.jyhad/"
+                "c/4emymfUPwAM/m/B2SCC7L6kuMJ"
+            )
+        },
+    )
+    assert response.status_code == 200
+    assert response.json()["reference"]["uid"] == "LSJ 20040518"
+
+
+@pytest.mark.asyncio
+async def test_cached_responses_etag(client):
+    response = await client.get("/api/card/100038")
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+    again = await client.get("/api/card/100038")
+    assert again.headers["etag"] == etag
+    assert again.json() == response.json()
+    response = await client.get("/api/card/100038", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    response = await client.get("/api/group/G00002")
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+    response = await client.get("/api/group/G00002", headers={"If-None-Match": f"W/{etag}"})
+    assert response.status_code == 304
+    response = await client.get("/api/group/G99999")
+    assert response.status_code == 404
+    # a proposal changes with every edit: no caching
+    await login_and_proposal(client)
+    response = await client.get("/api/card/100038")
+    assert response.status_code == 200
+    assert "etag" not in response.headers
+
+
 @pytest.mark.asyncio
 async def test_add_card_ruling(client):
     await login_and_proposal(client)
@@ -1054,6 +1119,19 @@ async def test_complete(client):
     ]
 
 
+def test_card_completion(app):
+    """The same cards, in the same order, as krcg's complete(): words in any order."""
+    card_map = vtesrulings.app.state.cards_map
+    completion = vtesrulings.app.state.cards_completion
+    queries = ["paris", "paris louvre", "bell theo", "theo b", "Étien", "anson's", "ghoul", "carna"]
+    for query in queries:
+        assert completion.complete(query) == card_map.complete(query), query
+    assert [c.id for c in completion.complete("paris louvre")] == [101127]
+    assert [c.id for c in completion.complete("bell theo")][:1] == [201362]
+    assert len(completion.complete("ghoul", 2)) == 2
+    assert completion.complete("") == completion.complete("zzzz") == []
+
+
 @pytest.mark.asyncio
 async def test_reminder_kind_reference_optional(client):
     await login_and_proposal(client)
@@ -1277,6 +1355,123 @@ def test_diff_override_only_modified():
     assert change2.previous.text == "Body [RTR 20070707]"
 
 
+def listed(group: models.Group, card_uid: str) -> models.CardInGroup:
+    """The card's entry in the group, which the test expects to be there."""
+    entry = group.member(card_uid)
+    assert entry is not None, card_uid
+    return entry
+
+
+def test_group_members_stay_indexed():
+    """Group.member() answers from a uid map, so every rewrite of `cards` must refresh it."""
+    from vtesrulings import proposal as proposal_mod
+
+    class FakeCard:
+        def __init__(self, cid, name):
+            self.id, self.unique_name, self.printed_name = cid, name, name
+            self.url = f"https://static.krcg.org/card/{cid}.jpg"
+
+    card_map = typing.cast(
+        krcg.collections.CardDict,
+        {cid: FakeCard(cid, f"Card {cid}") for cid in (100001, 100002, 100003)},
+    )
+
+    def member(uid, prefix=""):
+        return models.CardInGroup(
+            uid=uid, name=uid, printed_name=uid, img="", state=models.State.ORIGINAL, prefix=prefix
+        )
+
+    base = models.Index(
+        groups={
+            "G1": models.Group(
+                uid="G1",
+                name="Grp",
+                state=models.State.ORIGINAL,
+                cards=[member("100001"), member("100002")],
+            )
+        },
+        groups_of_card={"100001": {"G1"}, "100002": {"G1"}},
+    )
+    assert listed(base.groups["G1"], "100002").uid == "100002"  # indexed on construction
+    assert base.groups["G1"].member("100003") is None
+    manager = proposal_mod.Manager(card_map, base)
+    group = manager.update_group("G1", "Grp", {"100001": "[pot]", "100003": ""})
+    assert listed(group, "100001").state == models.State.MODIFIED
+    assert listed(group, "100002").state == models.State.DELETED
+    assert listed(group, "100003").state == models.State.NEW
+    assert [g.uid for g, _ in manager.get_groups_of("100003")] == ["G1"]
+    assert manager.restore_group_card("G1", "100003").member("100003") is None
+    assert listed(manager.restore_group_card("G1", "100001"), "100001").prefix == ""
+    # the proposal round-trips through JSON (the DB row) and comes back indexed
+    reloaded = proposal_mod.Proposal(**json.loads(json.dumps(dataclasses.asdict(manager.prop))))
+    assert listed(reloaded.groups["G1"], "100002").state == models.State.DELETED
+    merged = manager.merge()
+    assert merged.groups["G1"].member("100001") is not None
+    assert merged.groups["G1"].member("100002") is None  # removed on approval
+
+
+def test_backrefs_overlay():
+    """Backrefs merge the proposal's delta index over the base one; untouched cards are served
+    from the base index's memo, and every ruling edit drops the delta."""
+    from vtesrulings import proposal as proposal_mod
+
+    class FakeCard:
+        def __init__(self, cid):
+            self.id, self.unique_name, self.printed_name = cid, f"Card {cid}", f"Card {cid}"
+            self.url = ""
+
+    card_map = typing.cast(
+        krcg.collections.CardDict, {cid: FakeCard(cid) for cid in (100001, 100002, 100003)}
+    )
+    mention = models.CardSubstitution(
+        uid="100003", name="Card 100003", printed_name="Card 100003", img="", text="{Card 100003}"
+    )
+
+    def ruling(uid, target):
+        return models.Ruling(
+            uid=uid,
+            target=target,
+            text="See {Card 100003} [RTR 20070707]",
+            state=models.State.ORIGINAL,
+            cards=[mention],
+        )
+
+    def member(uid):
+        return models.CardInGroup(
+            uid=uid, name=uid, printed_name=uid, img="", state=models.State.ORIGINAL
+        )
+
+    card, group = models.NID("100001", "Card 100001"), models.NID("G1", "Grp")
+    base = models.Index(
+        groups={
+            "G1": models.Group(
+                uid="G1",
+                name="Grp",
+                state=models.State.ORIGINAL,
+                cards=[member("100001"), member("100002")],
+            )
+        },
+        rulings={"100001": {"r1": ruling("r1", card)}, "G1": {"g1": ruling("g1", group)}},
+        backrefs={"100003": [models.Backref("100001", "r1"), models.Backref("G1", "g1")]},
+    )
+
+    def backrefs(manager):
+        return [c.uid for c in manager.get_backrefs("100003")]
+
+    assert backrefs(proposal_mod.Manager(card_map, base)) == ["100001", "100002"]
+    assert [c.uid for c in base.memo("backrefs")["100003"]] == ["100001", "100002"]
+    manager = proposal_mod.Manager(card_map, base, proposal_mod.Proposal())
+    assert backrefs(manager) == ["100001", "100002"]
+    manager.delete_ruling("G1", "g1")
+    assert backrefs(manager) == ["100001"]  # the group ruling no longer counts
+    manager.restore_ruling("G1", "g1")
+    assert backrefs(manager) == ["100001", "100002"]
+    manager.delete_group("G1")
+    assert backrefs(manager) == ["100001"]  # nor do the members of a deleted group
+    # the base memo is per index: a merged index starts without one
+    assert manager.merge().memo("backrefs") == {}
+
+
 async def test_proposal_diff_page(client):
     """The proposal page SSR-renders the overlay diff: NEW/MODIFIED rulings, refs (pst #25)."""
     prop_uid = await login_and_proposal(client)
@@ -1613,3 +1808,396 @@ async def test_card_page_links_named_cards(client):
         in body
     )
     assert "&lt;" not in body
+
+
+@pytest.mark.asyncio
+async def test_anonymous_page_cache(client):
+    page = await client.get("/index.html?uid=100038")
+    assert page.status_code == 200
+    etag = page.headers["etag"]
+    assert "last-modified" not in page.headers  # a deploy changes the page too: ETag only
+    again = await client.get("/index.html?uid=100038")
+    assert again.text == page.text
+    response = await client.get("/index.html?uid=100038", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    response = await client.get(
+        "/index.html?uid=100038", headers={"If-Modified-Since": "Fri, 01 Jan 2100 00:00:00 GMT"}
+    )
+    assert response.status_code == 200
+    response = await client.get("/groups.html?uid=G00002", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    # logged-in users get their own chrome: no shared page
+    response = await client.post("/login", data={"username": "test-user"})
+    page = await client.get("/index.html?uid=100038")
+    assert page.status_code == 200
+    assert "etag" not in page.headers
+
+
+@pytest.mark.asyncio
+async def test_card_page_fragment_follows_proposal(client):
+    """The card body is cached per proposal version: an edit shows on the next page view."""
+    prop_uid = await login_and_proposal(client)
+    page = await client.get(f"/index.html?uid=100015&prop={prop_uid}")
+    assert page.status_code == 200
+    assert "Fragment test ruling" not in page.text
+    assert 'id="quickProposalButton"' not in page.text
+    response = await client.post(
+        "/api/ruling/100015", json={"text": "Fragment test ruling [RTR 20070707]"}
+    )
+    assert response.status_code == 200
+    page = await client.get(f"/index.html?uid=100015&prop={prop_uid}")
+    assert "Fragment test ruling" in page.text
+    page = await client.get("/groups.html?uid=G99999")
+    assert page.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_card_texts_precomputed(app):
+    """The card text markup rendered at startup is what the cardtext filter gives, for every card."""
+    card_map = vtesrulings.app.state.cards_map
+    manager = proposal.Manager(card_map, vtesrulings.app.state.index_holder.current.index)
+    card_texts = vtesrulings.app.state.card_texts
+    assert set(card_texts) == {str(card.id) for card in card_map.cards()}
+    for card in card_map.cards():
+        data = vtesrulings.plain(manager.get_card(card.id))
+        expected = vtesrulings.card_text(
+            data["text"], data["types"], data["text_symbols"], data["cards"]
+        )
+        assert card_texts[str(card.id)] == expected
+
+
+def legacy_ruling_body(ruling: dict):
+    """The replace-per-marker renderer ruling_body replaced, kept as its reference."""
+    esc = markupsafe.escape
+    s = esc(ruling["text"])
+    for reference in ruling["references"]:
+        s = s.replace(str(esc(reference["text"])), "")
+    s = str(esc(vtesrulings.emphasis(s)))
+    for text, symbol in {sub["text"]: sub["symbol"] for sub in ruling["symbols"]}.items():
+        s = s.replace(
+            text,
+            f'<span class="krcg-icon" contenteditable="false"'
+            f' data-marker="{esc(text)}">{symbol}</span>',
+        )
+    for text, card in {c["text"]: c for c in ruling["cards"]}.items():
+        s = s.replace(
+            str(esc(text)),
+            vtesrulings.card_span(card, str(esc(card["printed_name"])), text),
+        )
+    return markupsafe.Markup(vtesrulings.newlines(s.strip()))
+
+
+@pytest.mark.asyncio
+async def test_ruling_body_single_pass(app):
+    """The single-pass renderer gives the same bytes as the legacy one, group rulings included,
+    and serves repeated rulings from its memo."""
+    card_map = vtesrulings.app.state.cards_map
+    manager = proposal.Manager(card_map, vtesrulings.app.state.index_holder.current.index)
+    targets = [group.uid for group in manager.all_groups()]
+    targets.extend(str(card.id) for card in card_map.cards())
+    count = 0
+    for target in targets:
+        for ruling in manager.get_rulings(target):
+            data = vtesrulings.plain(ruling)
+            assert vtesrulings.ruling_body(data) == legacy_ruling_body(data)
+            assert vtesrulings.ruling_body(data) is vtesrulings.ruling_body(data)
+            count += 1
+    assert count
+
+
+@pytest.mark.asyncio
+async def test_export_static(app, tmp_path):
+    """Every card with rulings and every group is exported, and a rerun writes nothing new."""
+    card_map = vtesrulings.app.state.cards_map
+    manager = proposal.ReadOnlyManager(card_map, vtesrulings.app.state.index_holder.current.index)
+    targets = vtesrulings.static_targets(manager)
+    assert ("cards/100038.html", "index.html", "100038") in targets
+    assert ("groups/G00012.html", "groups.html", "G00012") in targets
+    files = {"search.json": vtesrulings.static_search(manager, targets)}
+    source = vtesrulings.static_source(manager)
+    stats = export.export(str(tmp_path), targets, source, files, jobs=1, compress=True)
+    assert stats == export.Stats(written=len(targets) + 1)
+    page = (tmp_path / "cards" / "100038.html").read_text()
+    assert "<title>Alastor — V:TES Rulings</title>" in page
+    assert 'href="/groups/G00002.html"' in (tmp_path / "cards" / "100316.html").read_text()
+    assert 'href="index.html' not in page and 'href="/index.html"' in page
+    assert (tmp_path / "groups" / "G00012.html.gz").exists()
+    manifest = json.loads((tmp_path / export.MANIFEST).read_text())
+    assert set(manifest) == {path for path, _, _ in targets} | {"search.json"}
+    stats = export.export(str(tmp_path), targets, source, files, jobs=1, compress=True)
+    assert stats == export.Stats(unchanged=len(targets) + 1)
+    stats = export.export(str(tmp_path), targets[1:], source, files, jobs=1)
+    assert stats.removed == 1 and not (tmp_path / targets[0][0]).exists()
+    with pytest.raises(RuntimeError):  # the app runs threads: no fork
+        export.export(str(tmp_path), targets, source, files, jobs=2)
+
+
+def test_static_links():
+    html = (
+        b'<a href="index.html">Cards</a><a href="index.html?uid=100038">Alastor</a>'
+        b'<a href="groups.html?uid=G00012">Black Hand</a><a href="proposal.html?uid=P1">P</a>'
+        b'<a href="#r-1">link</a>'
+    )
+    assert export.static_links(html) == (
+        b'<a href="/index.html">Cards</a><a href="/cards/100038.html">Alastor</a>'
+        b'<a href="/groups/G00012.html">Black Hand</a><a href="/proposal.html?uid=P1">P</a>'
+        b'<a href="#r-1">link</a>'
+    )
+
+
+@pytest.mark.asyncio
+async def test_export_rulings(client):
+    response = await client.get("/api/export/rulings.json")
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    index = vtesrulings.app.state.index_holder.current.index
+    data = response.json()
+    assert data["version"] == index.version
+    assert {"uid": "100038", "name": "Alastor"} in [r["target"] for r in data["rulings"]["100038"]]
+    assert "G00012" in [group["uid"] for group in data["groups"]]
+    assert "LSJ 20040518" in [reference["uid"] for reference in data["references"]]
+    etag = response.headers["etag"]
+    response = await client.get("/api/export/rulings.json", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    # built once per index version
+    plain = await client.get("/api/export/rulings.json", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in plain.headers
+    assert plain.headers["etag"] != etag and plain.json() == data
+    assert index.memo("export")["identity"].body == plain.content
+    refused = await client.get("/api/export/rulings.json", headers={"Accept-Encoding": "gzip;q=0"})
+    assert "content-encoding" not in refused.headers and refused.content == plain.content
+    for header, accepted in (
+        ("gzip, deflate", True),
+        ("deflate, GZIP;q=0.5", True),
+        ("br;q=1, gzip;q=0", False),
+        ("*;q=0.1", True),
+        ("*, gzip;q=0.0", False),
+        ("gzip;q=x", False),
+        ("", False),
+    ):
+        assert cache.accepts_encoding({"accept-encoding": header}, "gzip") is accepted, header
+
+
+@pytest.mark.asyncio
+async def test_changes_feed(client):
+    version = vtesrulings.app.state.index_holder.current.index.version
+    response = await client.get("/api/changes", params={"since": version[:8]})
+    assert response.status_code == 200
+    data = response.json()
+    assert data["version"] == data["since"] == version
+    assert not data["full_resync"]
+    for kind in ("rulings", "groups", "references"):
+        assert data[kind] == {"added": {}, "modified": {}, "deleted": []}
+    response = await client.get("/api/changes", params={"since": "0" * 40})
+    assert response.json() == {
+        "version": version,
+        "full_resync": True,
+        "export": "/api/export/rulings.json",
+    }
+    cached = len(vtesrulings.app.state.response_cache)
+    response = await client.get("/api/changes", params={"since": "1" * 40})
+    assert response.json()["full_resync"]
+    assert len(vtesrulings.app.state.response_cache) == cached  # one entry for unknown versions
+    response = await client.get("/api/changes")
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_events_stream():
+    broadcaster = events.Broadcaster(history=2, keepalive=0.01)
+    await broadcaster.resume(10)  # listening: the ids go on from the last one published
+    stream = broadcaster.stream(proposal="P1")
+    assert await anext(stream) == b"retry: 5000\n\n"
+    proposal_event = {"uid": "P2", "version": 3, "targets": ["100038"]}
+    await broadcaster.deliver(events.Event(11, "proposal", proposal_event))
+    await broadcaster.deliver(events.Event(12, "index", {"version": "abc", "targets": ["G00012"]}))
+    await broadcaster.deliver(events.Event(11, "proposal", proposal_event))  # already delivered
+    assert await anext(stream) == (
+        b'id: 12\nevent: index\ndata: {"version":"abc","targets":["G00012"]}\n\n'
+    )
+    assert await anext(stream) == b": keepalive\n\n"
+    # a client reconnecting (to any worker) gets what it missed, if still kept
+    resumed = broadcaster.stream(last_id=10, proposal="P2")
+    assert await anext(resumed) == b"retry: 5000\n\n"
+    assert (await anext(resumed)).startswith(b"id: 11\nevent: proposal\n")
+    await broadcaster.deliver(events.Event(13, "index", {"version": "def", "targets": []}))
+    await broadcaster.deliver(events.Event(14, "index", {"version": "ghi", "targets": []}))
+    resumed = broadcaster.stream(last_id=11)  # event 12 is gone
+    await anext(resumed)
+    assert await anext(resumed) == b"event: reset\ndata: {}\n\n"
+    ahead = broadcaster.stream(last_id=19)  # not relayed here yet
+    await anext(ahead)
+    assert await anext(ahead) == b"event: reset\ndata: {}\n\n"
+    # events missed by this worker: the streams open are reset
+    live = broadcaster.stream()
+    await anext(live)
+    await broadcaster.deliver(events.Event(16, "index", {"version": "jkl", "targets": []}))
+    assert await anext(live) == b"event: reset\ndata: {}\n\n"
+    await broadcaster.resume(20)
+    assert await anext(live) == b"event: reset\ndata: {}\n\n"
+    assert await anext(live) == b": keepalive\n\n"
+
+
+async def test_events_relayed(client):
+    """Events are published through the database, numbered there, and relayed to the workers."""
+    broadcaster = vtesrulings.app.state.events
+    await events.publish("proposal", {"uid": "P9", "version": 1, "targets": []})
+    await events.publish(
+        "proposal", {"uid": "P9", "version": 2, "targets": ["x" * events.MAX_DATA]}
+    )
+    last_id = await db.last_event_id()
+    async with asyncio.timeout(5):
+        while broadcaster.last_id < last_id:
+            await asyncio.sleep(0.01)
+    stream = broadcaster.stream(last_id=last_id - 2, proposal="P9")
+    await anext(stream)
+    assert await anext(stream) == (
+        b'id: %d\nevent: proposal\ndata: {"uid":"P9","version":1,"targets":[]}\n\n' % (last_id - 1)
+    )
+    assert await anext(stream) == b"id: %d\nevent: reset\ndata: {}\n\n" % last_id  # too large
+
+
+@pytest.mark.asyncio
+async def test_events_proposal_access(client):
+    response = await client.get("/api/events", params={"prop": "P1"})
+    assert response.status_code == 401
+    await login_and_proposal(client)
+    response = await client.get("/api/events", params={"prop": "P1"})
+    assert response.status_code == 403  # not the session proposal
+
+
+async def test_proposal_version(client):
+    """Only an edit changing the proposal content bumps its version."""
+    prop_uid = await login_and_proposal(client)
+    version = (await db.get_proposal(prop_uid))["version"]
+    assert (await client.get("/api/check-consistency")).status_code == 200
+    assert (await db.get_proposal(prop_uid))["version"] == version
+    reference = {"uid": "LSJ 20001225", "url": "https://groups.google.com/g/test"}
+    assert (await client.post("/api/reference", json=reference)).status_code == 200
+    assert (await db.get_proposal(prop_uid))["version"] == version + 1
+
+
+async def test_proposal_event_failure(client, monkeypatch):
+    """An edit saved is not failed by its event failing to publish."""
+    await login_and_proposal(client)
+
+    async def publish(kind, data):
+        raise OSError("the database is gone")
+
+    monkeypatch.setattr(events, "publish", publish)
+    reference = {"uid": "LSJ 20001225", "url": "https://groups.google.com/g/test"}
+    response = await client.post("/api/reference", json=reference)
+    assert response.status_code == 200
+    response = await client.get("/api/reference")
+    assert "LSJ 20001225" in [r["uid"] for r in response.json()]
+
+
+def test_proposal_event_targets():
+    prop = proposal.Proposal(uid="P1")
+    before = events.proposal_hashes(prop)
+    prop.references["X 20200101"] = models.Reference(uid="X 20200101", url="u", source="X")
+    prop.groups["P00001"] = models.Group(uid="P00001", name="Group", state=models.State.NEW)
+    after = events.proposal_hashes(prop)
+    assert events.changed(before, after) == ["P00001", "X 20200101"]
+    assert events.changed(after, events.proposal_hashes(prop)) == []
+
+
+def test_parse_decklist(app):
+    card_map = vtesrulings.app.state.cards_map
+    deck, unknown = utils.parse_decklist(
+        card_map,
+        "Deck Name: Test\n"
+        "Crypt (2 cards, min=8, max=8, avg=4)\n"
+        "2x Alastor\n"
+        "Library (4 cards)\n"
+        "# Master (1)\n"
+        "1 Chain of Command\n"
+        "Alastor x1\n"
+        "3x Not A Card\n",
+    )
+    assert deck == {100038: 3, 100316: 1}
+    assert unknown == ["3x Not A Card"]
+
+
+@pytest.mark.asyncio
+async def test_deck_rulings(client):
+    response = await client.post(
+        "/api/deck/rulings", json={"decklist": "2x Alastor\n1x Chain of Command\n1x Nope"}
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert [(card["uid"], card["count"]) for card in data["cards"]] == [
+        ("100038", 2),
+        ("100316", 1),
+    ]
+    assert data["unknown"] == ["1x Nope"]
+    keys = [(e["ruling"]["target"]["uid"], e["ruling"]["uid"]) for e in data["rulings"]]
+    assert len(keys) == len(set(keys))  # once each
+    alastor = [e for e in data["rulings"] if e["cards"] == ["100038"]]
+    assert len(alastor) == len((await client.get("/api/card/100038")).json()["rulings"])
+    group = [e for e in data["rulings"] if e["ruling"]["target"]["uid"] == "G00002"]
+    assert group and all(e["cards"] == ["100316"] for e in group)
+    by_ids = await client.post("/api/deck/rulings", json={"cards": [100038, "100038", 100316]})
+    assert by_ids.json()["rulings"] == data["rulings"]
+    response = await client.post(
+        "/api/deck/rulings",
+        content="1 Alastor",
+        headers={"Content-Type": "text/plain"},
+    )
+    assert [card["uid"] for card in response.json()["cards"]] == ["100038"]
+    response = await client.post("/api/deck/rulings", json={})
+    assert response.status_code == 400
+    response = await client.post("/api/deck/rulings", json={"cards": [1]})
+    assert response.status_code == 400
+
+
+async def test_status(client):
+    response = await client.get("/api/status")
+    assert response.status_code == 200
+    status = response.json()
+    assert status["generation"] >= 1
+    assert status["pid"] > 0
+    assert len(status["version"]) == 40
+    assert status["content_version"]
+    assert status["loading"] is None
+
+
+async def test_health(client):
+    """Ready once loaded; while loading, only what does not need the index is served."""
+    for path in ["/healthz", "/readyz"]:
+        response = await client.get(path)
+        assert response.status_code == 200
+        report = response.json()
+        assert report["ready"] is True
+        assert all(seconds is not None for seconds in report["phases"].values())
+        assert report["generation"] >= 1
+    state = vtesrulings.app.state
+    loaded = state.health
+    state.health = health.Health()  # as if just started
+    try:
+        state.health.done("cards")
+        response = await client.get("/readyz")
+        assert response.status_code == 503
+        assert response.json()["phases"]["cards"] is not None
+        assert response.json()["phases"]["index"] is None
+        assert (await client.get("/healthz")).status_code == 200
+        assert (await client.get("/index.html")).status_code == 503
+        assert (await client.get("/api/status")).status_code == 503
+        assert (await client.get("/nothing-here.html")).status_code == 404
+        assert (await client.get("/static/site.webmanifest")).status_code == 200
+    finally:
+        state.health = loaded
+    assert (await client.get("/index.html")).status_code == 200
+
+
+async def test_index_generation_header(client):
+    """Responses built from the index tell its version and generation."""
+    generation = vtesrulings.app.state.index_holder.current.number
+    response = await client.get("/api/card/100038")
+    assert response.status_code == 200
+    assert response.headers["x-index-generation"] == str(generation)
+    version = vtesrulings.app.state.index_holder.current.index.version
+    assert response.headers["x-index-version"] == version
+    response = await client.get("/index.html?uid=100038")
+    assert response.headers["x-index-generation"] == str(generation)
+    assert "x-index-generation" not in (await client.get("/healthz")).headers
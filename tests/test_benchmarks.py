@@ -0,0 +1,62 @@
+"""Micro-benchmarks, excluded from the default run: `just bench` (pytest -m benchmark).
+
+Timings depend on the machine, so nothing here asserts on speed: each benchmark prints its numbers
+for the reader and only checks the two sides it compares return something sensible."""
+
+import dataclasses
+import json
+import timeit
+
+import fastapi.encoders
+import orjson
+import pytest
+
+import vtesrulings
+from vtesrulings import proposal
+
+pytestmark = pytest.mark.benchmark
+
+
+def report(label: str, seconds: float, runs: int) -> None:
+    print(f"\n  {label:<40} {seconds / runs * 1e6:10.1f} µs/run")
+
+
+def best_of(func, runs: int) -> float:
+    return min(timeit.repeat(func, number=runs, repeat=5))
+
+
+#: Two names typed one keystroke at a time, as the search box sends them.
+KEYSTROKES = [word[:i] for word in ("theo bell", "carna") for i in range(2, len(word) + 1)]
+
+
+async def test_bench_complete(app):
+    """Per-prefix rankings vs krcg's complete(), sliced the way the endpoints used to slice it."""
+    card_map = vtesrulings.app.state.cards_map
+    completion = vtesrulings.app.state.cards_completion
+    runs = 20
+    krcg_time = best_of(lambda: [card_map.complete(q)[:10] for q in KEYSTROKES], runs)
+    index_time = best_of(lambda: [completion.complete(q, 10) for q in KEYSTROKES], runs)
+    report(f"krcg complete ({len(KEYSTROKES)} keystrokes)", krcg_time, runs)
+    report(f"CardCompletion ({len(KEYSTROKES)} keystrokes)", index_time, runs)
+    assert all(completion.complete(q) for q in KEYSTROKES)
+
+
+@pytest.mark.parametrize("payload", ["groups", "references"])
+async def test_bench_encode(app, payload):
+    """The largest payloads, /api/group and /api/reference: asdict() + FastAPI's encoder vs orjson
+    on the models themselves, as api.DataclassResponse does."""
+    manager = proposal.ReadOnlyManager(
+        vtesrulings.app.state.cards_map, vtesrulings.app.state.index_holder.current.index
+    )
+    models = list(manager.all_groups() if payload == "groups" else manager.all_references())
+    runs = 5
+
+    def legacy():
+        content = fastapi.encoders.jsonable_encoder([dataclasses.asdict(m) for m in models])
+        return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode()
+
+    legacy_time = best_of(legacy, runs)
+    orjson_time = best_of(lambda: orjson.dumps(models), runs)
+    report(f"asdict + jsonable_encoder ({len(models)} {payload})", legacy_time, runs)
+    report(f"orjson ({len(models)} {payload})", orjson_time, runs)
+    assert orjson.loads(orjson.dumps(models)) == json.loads(legacy())
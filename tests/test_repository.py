@@ -1,7 +1,14 @@
+import asyncio
+import copy
+import errno
+import os
+import socket
+
 import git
+from starlette.datastructures import State
 
 import vtesrulings
-from vtesrulings import models, repository, utils
+from vtesrulings import cache, changes, cluster, db, models, proposal, repository, server, utils
 
 
 def _commit(repo, work, body, date):
@@ -125,3 +132,300 @@ async def test_build_ruling_dedupes_pasted_reference(app):
     )
     assert ruling.text == "See [RTR 20070707] and also this. [RTR 20080808]"
     assert [r.uid for r in ruling.references] == ["RTR 20070707", "RTR 20080808"]
+
+
+async def test_check_consistency_matches_full_check(app):
+    """The consistency check only validates what the proposal touched, against invariants of the
+    base index: it must find exactly what a check of the whole corpus finds."""
+    manager = proposal.Manager(
+        vtesrulings.app.state.cards_map, vtesrulings.app.state.index_holder.current.index
+    )
+
+    def same_result():
+        touched, all_ = manager._check_touched(), manager._check_all()
+        assert sorted(map(repr, touched[0])) == sorted(map(repr, all_[0]))
+        assert touched[1] == all_[1]
+        return touched
+
+    assert same_result()[0] == []
+    manager.insert_ruling("100015", "No reference given")
+    manager.insert_ruling("100015", "Cites a known one [LSJ 20040518-2]")
+    manager.delete_reference("LSJ 20040518")
+    manager.insert_reference("ANK 20991231", "https://groups.google.com/g/x")
+    group = manager.insert_group("Circle")
+    manager.update_group(group.uid, cards={"100015": ""})
+    manager.update_group("G00002", name="Temporary control", cards={"100316": ""})
+    manager.insert_group()
+    for ruling in list(manager.get_rulings("G00001")):
+        manager.delete_ruling("G00001", ruling.uid)
+    errors, unused = same_result()
+    assert errors
+    assert "ANK 20991231" in unused
+    manager.delete_group("G00003")
+    manager.delete_group(group.uid)
+    same_result()
+
+
+async def test_group_rulings_materialized(app):
+    """Cards see their groups' rulings from the list load_base() materialized, unless the proposal
+    touches one of their groups."""
+    index = vtesrulings.app.state.index_holder.current.index
+    manager = proposal.Manager(vtesrulings.app.state.cards_map, index)
+    for card_uid in index.groups_of_card:
+        computed = [
+            manager._effective_group_ruling(card_uid, ruling, card_in_group)
+            for group, card_in_group in manager.get_groups_of(card_uid)
+            for ruling in manager.get_rulings(group.uid)
+        ]
+        assert index.group_rulings.get(card_uid, []) == computed
+    group = index.groups["G00002"]
+    cards = {c.uid: c.prefix for c in group.cards} | {"100316": "[DOM]"}
+    manager.update_group("G00002", cards=cards)
+    rulings = [r for r in manager.get_rulings("100316") if r.target.uid == "G00002"]
+    assert rulings and all(r.text.startswith("[DOM] ") for r in rulings)
+
+
+async def test_read_only_manager(app):
+    """Without a proposal, the read-only manager gives the same answers as the overlay one."""
+    index = vtesrulings.app.state.index_holder.current.index
+    cards_map = vtesrulings.app.state.cards_map
+    full = proposal.Manager(cards_map, index)
+    fast = proposal.ReadOnlyManager(cards_map, index)
+    assert list(fast.all_groups()) == list(full.all_groups())
+    assert list(fast.all_references()) == list(full.all_references())
+    assert list(fast.all_rulings()) == list(full.all_rulings())
+    for uid in list(index.rulings) + list(index.groups_of_card):
+        assert list(fast.get_rulings(uid)) == list(full.get_rulings(uid))
+        if not uid.startswith("G"):
+            assert list(fast.get_groups_of(uid)) == list(full.get_groups_of(uid))
+    for ref in index.references.values():
+        assert fast.get_reference_by_url(ref.url) == full.get_reference_by_url(ref.url)
+        assert list(fast.get_citations(ref.uid)) == list(full.get_citations(ref.uid))
+
+
+async def test_change_log(app):
+    """Diffing the content hashes of two versions gives what the proposal merged touched."""
+    index = vtesrulings.app.state.index_holder.current.index
+    cards_map = vtesrulings.app.state.cards_map
+    old = index.hashes
+    fresh = next(str(card.id) for card in cards_map.cards() if str(card.id) not in index.rulings)
+    manager = proposal.Manager(cards_map, index)
+    manager.insert_ruling("100038", "A new ruling. [LSJ 20040518]")
+    manager.insert_ruling(fresh, "A first ruling. [LSJ 20040518]")
+    merged = manager.merge()
+    merged.version = "f" * 40
+    new = merged.hashes
+    delta = new.diff(old)
+    assert delta["rulings"] == {"added": [fresh], "modified": ["100038"], "deleted": []}
+    assert delta["groups"] == delta["references"] == {"added": [], "modified": [], "deleted": []}
+    assert old.diff(new)["rulings"]["deleted"] == [fresh]
+    log = changes.ChangeLog(2)
+    await log.record(index.version, old)
+    await log.record(merged.version, new)
+    assert await log.find(index.version) == (index.version, old)
+    assert await log.find("fffffff") == (merged.version, new)
+    assert await log.find("fff") is None  # too short to be a sha prefix
+    assert await log.find("ffffffg") is None
+    # kept in the database: another worker, or the next deploy, finds the versions recorded
+    assert await changes.ChangeLog(2).find(merged.version[:8]) == (merged.version, new)
+    await log.record("e" * 40, new)
+    assert len(log) == 2 and index.version not in log
+    assert await changes.ChangeLog(2).find(index.version) is None
+    await vtesrulings.app.state.changelog.record(index.version, old)  # as the app recorded it
+
+
+async def test_content_hashes(app):
+    """A merge rehashes what the proposal touched only, to the hashes a full load would give."""
+    index = vtesrulings.app.state.index_holder.current.index
+    cards_map = vtesrulings.app.state.cards_map
+    assert set(index.hashes.items["rulings"]) == {uid for uid, r in index.rulings.items() if r}
+    assert set(index.hashes.items["groups"]) == set(index.groups)
+    assert index.content_version
+    unchanged = proposal.Manager(cards_map, index).merge()
+    assert unchanged.content_version == index.content_version
+    assert unchanged.hashes.diff(index.hashes)["rulings"]["modified"] == []
+    manager = proposal.Manager(cards_map, index)
+    ruling = next(iter(index.rulings["100038"].values()))
+    manager.update_ruling("100038", ruling.uid, ruling.text + " Updated.")
+    reference = next(uid for uid in index.references if uid.startswith("RTR"))  # no date
+    manager.update_reference(reference, index.references[reference].url + "-2")
+    manager.delete_group("G00012")
+    merged = manager.merge()
+    assert merged.content_version != index.content_version
+    full = copy.deepcopy(merged)
+    full.hashes = models.ContentHashes()
+    full.rehash()
+    assert full.hashes == merged.hashes
+    delta = merged.hashes.diff(index.hashes)
+    assert delta["rulings"]["modified"] == ["100038"]
+    assert delta["references"]["modified"] == [reference]
+    assert delta["groups"]["deleted"] == ["G00012"]
+    rulings = merged.rulings["100038"]
+    assert len(rulings) > 1
+    reordered = dict(reversed(rulings.items()))  # as edits leave them
+    assert models._HASHERS["rulings"](reordered) == models._HASHERS["rulings"](rulings)
+
+
+async def test_index_snapshot(app, tmp_path, monkeypatch):
+    """Workers load the index another one built from its snapshot, the latest ones kept."""
+    monkeypatch.setattr(cluster, "SNAPSHOT_DIR", str(tmp_path))
+    index = vtesrulings.app.state.index_holder.current.index
+    cards_map = vtesrulings.app.state.cards_map
+    cluster.write_snapshot(index)
+    loaded = cluster.read_snapshot(index.version)
+    assert loaded is not None and loaded is not index
+    assert loaded.hashes == index.hashes and loaded.rulings == index.rulings
+    assert loaded.group_rulings == index.group_rulings and loaded.memo("export") == {}
+    assert cluster.read_snapshot("0" * 40) is None
+    monkeypatch.setattr(cluster, "INDEX_FORMAT", cluster.INDEX_FORMAT + 1)
+    assert cluster.read_snapshot(index.version) is None  # another format: rebuilt
+    monkeypatch.setattr(cluster, "INDEX_FORMAT", cluster.INDEX_FORMAT - 1)
+    repo = vtesrulings.app.state.rulings_repo
+    assert (await cluster.load(repo, cards_map)).hashes == index.hashes
+    for i in range(cluster.SNAPSHOTS_KEPT + 2):
+        other = copy.copy(index)
+        other.version = f"{i:040}"
+        cluster.write_snapshot(other)
+    assert len(list(tmp_path.glob("*.json"))) == cluster.SNAPSHOTS_KEPT
+    tmp_path.chmod(0o755)  # others could read it, or worse if writable: not trusted
+    assert cluster.read_snapshot(other.version) is None
+    tmp_path.chmod(0o700)
+    assert cluster.read_snapshot(other.version) == other
+    monkeypatch.setattr(cluster, "SNAPSHOT_DIR", str(tmp_path / "private"))
+    cluster.write_snapshot(index)
+    assert (tmp_path / "private").stat().st_mode & 0o777 == 0o700
+
+
+async def test_index_channel(app):
+    """A payload notified on a channel reaches its listeners (not the app's: it would follow),
+    after the empty one telling they listen."""
+    channel = db.listen("test_channel")
+    try:
+        async with asyncio.timeout(10):
+            assert await anext(channel) == ""
+            await db.notify("test_channel", "f" * 40)
+            assert await anext(channel) == "f" * 40
+    finally:
+        await channel.aclose()
+
+
+async def test_follow_remote_head(app):
+    """Following the remote HEAD the worker is at already does not swap its index."""
+    generation = app.state.index_holder.current.number
+    index = app.state.index_holder.current.index
+    await cluster.follow(app.state)
+    assert app.state.index_holder.current.number == generation
+    assert app.state.index_holder.current.index is index
+    follower = cluster.Follower(app.state)
+    runner = asyncio.create_task(follower.run())
+    try:
+        for version in ["", index.version, index.version]:  # a burst: only the last loads
+            follower.want(version)
+        await asyncio.sleep(0)
+        assert follower.wanted is None
+        async with asyncio.timeout(10):
+            while follower.loading is not None:
+                await asyncio.sleep(0.05)
+    finally:
+        runner.cancel()
+    assert app.state.index_holder.current.number == generation
+
+
+def test_preload(app):
+    """Preloading (before the workers fork) gives the cards and the index the lifespan loads."""
+    state = State()
+    vtesrulings.preload(state)
+    assert state.cards_map[100038].printed_name == app.state.cards_map[100038].printed_name
+    assert state.card_texts.keys() == app.state.card_texts.keys()
+    index = app.state.index_holder.current.index
+    assert state.preloaded_index.version == index.version
+    assert state.preloaded_index.content_version == index.content_version
+    usage = server.memory()
+    assert usage["rss"] >= usage["private"] > 0
+
+
+def test_standby_handoff(tmp_path, monkeypatch):
+    """A standby process replaces the one its pidfile names, and tells systemd it took over."""
+    pidfile = str(tmp_path / "rulings.pid")
+    assert server.replaced(pidfile) is None
+    server.write_pidfile(pidfile)
+    assert server.read_pidfile(pidfile) == os.getpid()
+    assert server.replaced(pidfile) is None  # not replacing itself
+    with open(pidfile, "w") as f:
+        f.write(f"{os.getppid()}\n")
+    assert server.replaced(pidfile) == os.getppid()
+    with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+        sock.bind(str(tmp_path / "notify"))
+        monkeypatch.setenv("NOTIFY_SOCKET", str(tmp_path / "notify"))
+        server.notify_systemd("READY=1")
+        assert sock.recv(64) == b"READY=1"
+
+
+def test_standby_takes_over_first(tmp_path, monkeypatch):
+    """The previous process is only signalled once this one is the unit's main process."""
+    pidfile = str(tmp_path / "rulings.pid")
+    calls = []
+
+    class Socket:
+        taken = True  # by a previous process predating the standby mode
+
+        def bind(self, addr):
+            calls.append(("bind", self.taken))
+            if self.taken:
+                raise OSError(errno.EADDRINUSE, "taken")
+
+        def listen(self, backlog):
+            calls.append(("listen",))
+
+    def kill(pid, signum):
+        calls.append(("kill", pid, server.read_pidfile(pidfile)))
+        Socket.taken = False
+
+    monkeypatch.setattr(server, "notify_systemd", lambda message: calls.append((message,)))
+    monkeypatch.setattr(os, "kill", kill)
+    monkeypatch.setattr(server.time, "sleep", lambda seconds: None)
+    server._take_over(Socket(), ("127.0.0.1", 80), 12345, pidfile)  # ty: ignore[invalid-argument-type]
+    ready = (f"READY=1\nMAINPID={os.getpid()}",)
+    assert calls == [
+        ("bind", True),
+        ready,
+        ("kill", 12345, os.getpid()),
+        ("bind", False),
+        ("listen",),
+    ]
+    calls.clear()
+    server._take_over(Socket(), ("127.0.0.1", 80), 12345, pidfile)  # ty: ignore[invalid-argument-type]
+    assert calls == [("bind", False), ("listen",), ready, ("kill", 12345, os.getpid())]
+
+
+def test_index_holder():
+    """Each swap is a new generation; a response built from an older one is not cached."""
+    first, second = models.Index(version="a" * 40), models.Index(version="b" * 40)
+    holder = cluster.IndexHolder(first)
+    pinned = holder.current
+    assert (pinned.number, pinned.index) == (1, first)
+    assert holder.swap(second) is pinned
+    assert (holder.current.number, holder.current.index) == (2, second)
+    assert pinned.index is first  # a request pinned before the swap keeps its index
+    response_cache = cache.ResponseCache(1024)
+    response_cache.put(holder.current.number, "key", b"new")
+    assert response_cache.get(pinned.number, "key") is None
+    assert response_cache.put(pinned.number, "key", b"old").body == b"old"
+    entry = response_cache.get(holder.current.number, "key")
+    assert entry is not None and entry.body == b"new"
+    holder.swap(first)
+    assert response_cache.get(holder.current.number, "key") is None
+    assert len(response_cache) == 0
+
+
+async def test_index_holder_reached():
+    """An index event waits for the worker to serve its version, or to skip it."""
+    holder = cluster.IndexHolder(models.Index(version="a" * 40))
+    assert await holder.reached("a" * 40, 0)
+    assert not await holder.reached("b" * 40, 0.01)
+    waiting = asyncio.create_task(holder.reached("b" * 40, 5))
+    await asyncio.sleep(0)
+    holder.swap(models.Index(version="b" * 40))
+    assert await waiting
+    holder.skip("c" * 40)
+    assert await holder.reached("c" * 40, 0)